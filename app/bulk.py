@@ -0,0 +1,91 @@
+import orjson
+from fastapi.encoders import jsonable_encoder
+from pydantic import ValidationError
+from pymongo.errors import BulkWriteError
+
+BULK_CHUNK_SIZE = 1000
+EXPORT_BATCH_SIZE = 1000
+
+
+async def read_rows(request):
+    """
+    Yields the rows of a request body. NDJSON bodies are parsed line by line while they are received, any other
+    body is parsed as a JSON array.
+    """
+    content_type = request.headers.get("content-type", "")
+    if "ndjson" not in content_type and "jsonlines" not in content_type:
+        rows = orjson.loads(await request.body())
+        if not isinstance(rows, list):
+            raise ValueError("Request body must be a JSON array or NDJSON")
+
+        for row in rows:
+            yield row
+        return
+
+    buffer = b""
+    async for chunk in request.stream():
+        buffer += chunk
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                yield line
+
+    if buffer.strip():
+        yield buffer
+
+
+async def insert_chunk(collection, entities, rows, errors):
+    """ Insert a chunk of entities with a single unordered write and collect the rows that failed """
+    try:
+        result = await collection.insert_many(entities, ordered=False)
+        return len(result.inserted_ids)
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            errors.append({"row": rows[error["index"]], "error": error.get("errmsg")})
+        return e.details.get("nInserted", 0)
+
+
+async def bulk_import(collection, model, request):
+    """ Validate every row of the request body with the model and insert valid rows in chunks """
+    inserted = 0
+    errors = []
+    entities = []
+    rows = []
+
+    row = 0
+    async for raw in read_rows(request):
+        try:
+            data = orjson.loads(raw) if isinstance(raw, bytes) else raw
+            if not isinstance(data, dict):
+                raise ValueError("Row must be a JSON object")
+            entities.append(jsonable_encoder(model(**data)))
+            rows.append(row)
+        except ValidationError as e:
+            errors.append({"row": row, "error": e.errors()})
+        except ValueError as e:
+            errors.append({"row": row, "error": str(e)})
+
+        if len(entities) >= BULK_CHUNK_SIZE:
+            inserted += await insert_chunk(collection, entities, rows, errors)
+            entities = []
+            rows = []
+
+        row += 1
+
+    if entities:
+        inserted += await insert_chunk(collection, entities, rows, errors)
+
+    return {"inserted": inserted, "failed": len(errors), "errors": errors}
+
+
+async def export_ndjson(collection, model):
+    """ Stream all entities of a collection as NDJSON, one cursor batch at a time """
+    lines = []
+    async for entity in collection.find().sort("_id", 1).batch_size(EXPORT_BATCH_SIZE):
+        lines.append(orjson.dumps(model.to_json(entity)))
+        if len(lines) >= EXPORT_BATCH_SIZE:
+            yield b"\n".join(lines) + b"\n"
+            lines = []
+
+    if lines:
+        yield b"\n".join(lines) + b"\n"
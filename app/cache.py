@@ -0,0 +1,139 @@
+import time
+from collections import OrderedDict
+
+import orjson
+from bson import ObjectId
+from decouple import config
+
+CACHE_BACKEND = config("CACHE_BACKEND", default="memory")
+CACHE_TTL = config("CACHE_TTL", default=60, cast=int)
+CACHE_MAX_SIZE = config("CACHE_MAX_SIZE", default=10000, cast=int)
+CACHE_REDIS_URL = config("CACHE_REDIS_URL", default="redis://redis:6379/0")
+
+
+def get_cache_key(collection, id, version):
+    """
+    Cache key of a single entity at a collection version, every spelling of its ObjectId maps to the same key. An
+    entry filled before a write is never read under the version bumped after it, so stale entries need no
+    invalidation and are left to expire.
+    """
+    return f"{collection}:{ObjectId(id)}:{version}"
+
+
+class MemoryCache(object):
+    """
+    In-process LRU cache with a TTL per entry. Every API worker process has its own cache, keys carry the entity
+    version, so a write through another worker is seen as soon as this worker sees the new version.
+    """
+
+    def __init__(self, max_size=CACHE_MAX_SIZE, ttl=CACHE_TTL):
+        self._max_size = max_size
+        self._ttl = ttl
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    async def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+
+        expires_at, value = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return None
+
+        # mark entry as most recently used
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    async def set(self, key, value):
+        self._entries[key] = (time.monotonic() + self._ttl, value)
+        self._entries.move_to_end(key)
+
+        # evict least recently used entries
+        while len(self._entries) > self._max_size:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def delete(self, key):
+        self._entries.pop(key, None)
+
+    async def close(self):
+        self._entries.clear()
+
+    async def stats(self):
+        requests = self.hits + self.misses
+        return dict(
+            backend="memory",
+            size=len(self._entries),
+            max_size=self._max_size,
+            ttl=self._ttl,
+            hits=self.hits,
+            misses=self.misses,
+            hit_ratio=self.hits / requests if requests else 0.0,
+            evictions=self.evictions,
+            expirations=self.expirations
+        )
+
+
+class RedisCache(object):
+    """ Cache shared by all API workers, entries expire after the TTL and Redis evicts entries on its own policy """
+
+    def __init__(self, url=CACHE_REDIS_URL, ttl=CACHE_TTL):
+        # only required when the shared cache is used
+        import redis.asyncio
+
+        self._client = redis.asyncio.from_url(url)
+        self._ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        value = await self._client.get(key)
+        if value is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return orjson.loads(value)
+
+    async def set(self, key, value):
+        await self._client.set(key, orjson.dumps(value), ex=self._ttl)
+
+    async def delete(self, key):
+        await self._client.delete(key)
+
+    async def close(self):
+        await self._client.close()
+
+    async def stats(self):
+        requests = self.hits + self.misses
+        info = await self._client.info("stats")
+        return dict(
+            backend="redis",
+            size=await self._client.dbsize(),
+            ttl=self._ttl,
+            hits=self.hits,
+            misses=self.misses,
+            hit_ratio=self.hits / requests if requests else 0.0,
+            evictions=info.get("evicted_keys"),
+            expirations=info.get("expired_keys")
+        )
+
+
+def create_cache():
+    """ Create the cache of the configured backend """
+    if CACHE_BACKEND == "redis":
+        return RedisCache()
+
+    return MemoryCache()
+
+
+cache = create_cache()
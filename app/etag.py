@@ -0,0 +1,194 @@
+import asyncio
+import hashlib
+import logging
+import time
+
+from decouple import config
+from fastapi import Response, status
+from pymongo.errors import OperationFailure, PyMongoError
+
+from database.async_database import mongo
+from database.settings import CHANGE_STREAMS_NOT_SUPPORTED
+from database.versions import (
+    VERSIONS_BACKEND, VERSIONS_COLLECTION, VERSIONS_REDIS_URL, bump_version_async, get_initial_version,
+    get_version_async, get_version_key
+)
+
+logger = logging.getLogger(__name__)
+
+# how long a version read from MongoDB is trusted when change streams are not available
+VERSION_MAX_AGE_MS = config("VERSION_MAX_AGE_MS", default=1000, cast=int)
+VERSION_RETRY_DELAY = config("VERSION_RETRY_DELAY", default=5, cast=int)
+
+
+class MongoVersions(object):
+    """
+    In-process copy of the collection versions stored in MongoDB, so that reading a version costs no round trip.
+    A change stream on the versions keeps the copy current. Where change streams are not available, e.g. standalone
+    servers, a version is read again once it is older than the max age. Writes of this worker are seen at once.
+    """
+
+    def __init__(self, max_age_ms=VERSION_MAX_AGE_MS):
+        self._max_age = max_age_ms / 1000
+        self._versions = dict()
+        self._generation = 0
+        self._live = False
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.get_event_loop().create_task(self.watch())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        self._task = None
+
+    def set(self, collection, version):
+        """ Store a version read at this moment, versions only grow so an older one never replaces a newer one """
+        current = self._versions.get(collection)
+        if current is None or current[1] <= version:
+            self._versions[collection] = (time.monotonic(), version)
+
+    def reset(self, live):
+        """ Forget all versions, reads that started before are not stored """
+        self._versions = dict()
+        self._generation += 1
+        self._live = live
+
+    async def get(self, collection):
+        entry = self._versions.get(collection)
+        if entry is not None and (self._live or time.monotonic() - entry[0] < self._max_age):
+            return entry[1]
+
+        generation = self._generation
+        version = await get_version_async(mongo.db, collection)
+        if generation == self._generation:
+            self.set(collection, version)
+        return version
+
+    async def bump(self, collection):
+        self.set(collection, await bump_version_async(mongo.db, collection))
+
+    async def watch(self):
+        """ Follow version changes, versions expire after the max age while the change stream is not open """
+        while True:
+            try:
+                async with mongo.db.get_collection(VERSIONS_COLLECTION).watch(full_document="updateLookup") as stream:
+                    # open the stream before trusting the copy, versions may have changed while it was not open
+                    change = await stream.try_next()
+                    self.reset(live=True)
+                    while True:
+                        if change is not None and change.get("fullDocument"):
+                            self.set(change["documentKey"]["_id"], change["fullDocument"]["version"])
+                        change = await stream.next()
+            except OperationFailure as e:
+                self.reset(live=False)
+                if e.code == CHANGE_STREAMS_NOT_SUPPORTED:
+                    logger.info(f"Change streams are not supported, versions are re-read after {self._max_age} s")
+                    return
+                logger.error(f"Version change stream failed, retrying in {VERSION_RETRY_DELAY} s: {e}")
+            except PyMongoError as e:
+                self.reset(live=False)
+                logger.error(f"Version change stream failed, retrying in {VERSION_RETRY_DELAY} s: {e}")
+
+            await asyncio.sleep(VERSION_RETRY_DELAY)
+
+
+class RedisVersions(object):
+    """ Collection versions shared by all API workers and consumers through Redis """
+
+    def __init__(self, url=VERSIONS_REDIS_URL):
+        # only required when versions are kept in Redis
+        import redis.asyncio
+
+        self._client = redis.asyncio.from_url(url)
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        await self._client.close()
+
+    async def get(self, collection):
+        key = get_version_key(collection)
+        version = await self._client.get(key)
+        if version is None:
+            async with self._client.pipeline() as pipeline:
+                _, version = await pipeline.set(key, get_initial_version(), nx=True).get(key).execute()
+
+        return int(version)
+
+    async def bump(self, collection):
+        key = get_version_key(collection)
+        async with self._client.pipeline() as pipeline:
+            await pipeline.set(key, get_initial_version(), nx=True).incr(key).execute()
+
+
+def create_versions():
+    """ Create the version store of the configured cache backend """
+    if VERSIONS_BACKEND == "redis":
+        return RedisVersions()
+
+    return MongoVersions()
+
+
+versions = create_versions()
+
+
+def get_entities_name(collection):
+    """ Name of the version of the existing entities of a collection, inserting new entities does not change it """
+    return f"{collection}:entities"
+
+
+async def get_version(collection):
+    """ Current version of a collection, it changes on every write """
+    return await versions.get(collection)
+
+
+async def get_entity_version(collection):
+    """ Current version of the existing entities of a collection, it changes on every update and delete """
+    return await versions.get(get_entities_name(collection))
+
+
+def build_etag(collection, version, *parts):
+    """
+    Strong ETag of a response built from a collection. The collection version changes on every write, so the same
+    version and request parts always produce the same response body.
+    """
+    key = "|".join(str(part) for part in (collection, version) + parts)
+    return f'"{hashlib.blake2b(key.encode("utf8"), digest_size=12).hexdigest()}"'
+
+
+async def get_etag(collection, *parts):
+    """ Strong ETag of a response built from the current version of a collection """
+    return build_etag(collection, await get_version(collection), *parts)
+
+
+def is_not_modified(request, etag):
+    """ Whether the client already has the response with the given ETag """
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+
+    tags = [tag.strip() for tag in header.split(",")]
+    return "*" in tags or etag in tags
+
+
+def not_modified(etag):
+    """ Empty 304 response, nothing is queried nor serialized """
+    return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+
+
+async def mark_modified(collection, entities=True):
+    """
+    Invalidate all list ETags of a collection after a write. Updates and deletes also invalidate the ETags and
+    cached bodies of its entities, inserts pass `entities=False` as no response of a new entity was served yet.
+    """
+    await versions.bump(collection)
+    if entities:
+        await versions.bump(get_entities_name(collection))
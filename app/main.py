@@ -1,15 +1,27 @@
 import logging
+import random
 import sys
 import time
 
 import uvicorn
+from anyio import to_thread
 from decouple import config
 
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
+from fastapi.responses import ORJSONResponse
+from prometheus_client import CONTENT_TYPE_LATEST, generate_latest
 
+from database.async_database import mongo
+from database.indexes import ensure_indexes_async
+from app.cache import cache
+from app.etag import versions
+from app.metrics import observe_request
+from app.stream import penalty_stream
 from app.routes.driver import router as driver_router
 from app.routes.car import router as car_router
 from app.routes.trip import router as trip_router
+from app.routes.penalty import router as penalty_router
+from app.routes.diagnostics import router as diagnostics_router
 
 # configure logging
 logging.basicConfig(
@@ -22,9 +34,40 @@ logger = logging.getLogger(__name__)
 
 HOST = config("HOST")
 PORT = int(config("PORT"))
+# fraction of requests written to the access log, server errors are always logged
+ACCESS_LOG_SAMPLE_RATE = config("ACCESS_LOG_SAMPLE_RATE", default=0.0, cast=float)
+# threads running sync code, e.g. sync dependencies and file responses, 0 keeps the anyio default of 40
+API_THREADPOOL_SIZE = config("API_THREADPOOL_SIZE", default=0, cast=int)
 
 # instantiate FastAPI
-app = FastAPI()
+app = FastAPI(default_response_class=ORJSONResponse)
+
+
+@app.on_event("startup")
+async def startup():
+    # size the threadpool shared by all sync code of the application
+    if API_THREADPOOL_SIZE:
+        to_thread.current_default_thread_limiter().total_tokens = API_THREADPOOL_SIZE
+    # open database connection pool
+    mongo.connect()
+    # create missing collection indexes
+    await ensure_indexes_async(mongo.db)
+    # follow collection versions of ETags and cached entities
+    versions.start()
+    # follow new penalties for stream subscribers
+    penalty_stream.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    # stop following new penalties
+    await penalty_stream.stop()
+    # stop following collection versions
+    await versions.stop()
+    # close database connection pool
+    mongo.close()
+    # close cache connections
+    await cache.close()
 
 
 @app.middleware("http")
@@ -37,25 +80,39 @@ async def api_read_root():
     return {"message": "Welcome to Fleet Management System"}
 
 
+@app.get("/metrics", include_in_schema=False)
+async def api_read_metrics():
+    return Response(generate_latest(), media_type=CONTENT_TYPE_LATEST)
+
+
 app.include_router(driver_router, tags=["Drivers"], prefix="/drivers")
 app.include_router(car_router, tags=["Cars"], prefix="/cars")
 app.include_router(trip_router, tags=["Trips"], prefix="/trips")
+app.include_router(penalty_router, tags=["Penalties"], prefix="/penalties")
+app.include_router(diagnostics_router, tags=["Diagnostics"], prefix="/diagnostics")
 
 
 async def handle_http_middleware(request, call_next):
-    # store start request datetime
-    start_time = time.time()
+    # store start request time on a monotonic clock
+    start_time = time.perf_counter()
     # execute request
     response = await call_next(request)
-    # calculate request time in ms
-    process_time = (time.time() - start_time) * 1000
+    # calculate request time in seconds
+    process_time = time.perf_counter() - start_time
+    # record request count and duration
+    observe_request(request, response.status_code, process_time)
+
+    # only a sample of the requests is logged
+    if response.status_code < 500 and random.random() >= ACCESS_LOG_SAMPLE_RATE:
+        return response
+
     # log request duration
     logger.info(
         f"{request.url.hostname} "
         f"[{request.url.scheme.upper()}/{request.scope.get('http_version')}] "
         f"\"{request.method} {request.url.path}\" "
         f"{response.status_code} "
-        f"({'{0:.2f}'.format(process_time)} ms)"
+        f"({'{0:.2f}'.format(process_time * 1000)} ms)"
     )
     return response
 
@@ -0,0 +1,31 @@
+from prometheus_client import Counter, Histogram
+from starlette.routing import Match
+
+REQUESTS = Counter("fms_http_requests_total", "HTTP requests", ["method", "route", "status"])
+REQUEST_DURATION = Histogram(
+    "fms_http_request_duration_seconds",
+    "Duration of HTTP requests",
+    ["method", "route"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+)
+
+
+def get_route_path(request):
+    """ Path template of the route that handled the request, so that entity ids do not become metric labels """
+    route = request.scope.get("route")
+    if route is not None:
+        return route.path
+
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+
+    return "unmatched"
+
+
+def observe_request(request, status_code, duration):
+    """ Record a handled request and its duration in seconds """
+    route = get_route_path(request)
+    REQUESTS.labels(request.method, route, status_code).inc()
+    REQUEST_DURATION.labels(request.method, route).observe(duration)
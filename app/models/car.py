@@ -1,3 +1,5 @@
+from datetime import datetime
+
 from pydantic import BaseModel
 
 
@@ -18,3 +20,46 @@ class CarModel(BaseModel):
                 "brand": "Mazda"
             }
         }
+
+
+class CarSpeedModel(BaseModel):
+
+    timestamp: datetime
+    min_speed: int
+    max_speed: int
+    avg_speed: float
+    count: int
+
+    @classmethod
+    def to_json(cls, entity):
+        if not entity:
+            return dict()
+
+        # raw readings are returned as single reading buckets
+        if "bucket" not in entity:
+            return dict(
+                timestamp=entity["timestamp"],
+                min_speed=entity["speed"],
+                max_speed=entity["speed"],
+                avg_speed=float(entity["speed"]),
+                count=1
+            )
+
+        return dict(
+            timestamp=entity["bucket"],
+            min_speed=entity["min_speed"],
+            max_speed=entity["max_speed"],
+            avg_speed=entity["speed_sum"] / entity["count"],
+            count=entity["count"]
+        )
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "timestamp": "2022-01-21T10:15:00",
+                "min_speed": 42,
+                "max_speed": 97,
+                "avg_speed": 68.5,
+                "count": 12
+            }
+        }
@@ -1,7 +1,10 @@
-from datetime import date
+from datetime import date, datetime
+from typing import Any, Dict, Optional
 
 from pydantic import BaseModel
 
+from app.models.car import CarModel
+
 
 class DriverModel(BaseModel):
 
@@ -74,7 +77,8 @@ class DriverPenaltyModel(BaseModel):
             speed=entity["speed"],
             penalty_points=entity["penalty_points"],
             latitude=entity["latitude"],
-            longitude=entity["longitude"]
+            longitude=entity["longitude"],
+            created_at=entity.get("created_at")
         )
 
     class Config:
@@ -83,7 +87,132 @@ class DriverPenaltyModel(BaseModel):
                 "driver_id": "61e9d7fa22d8e7b0e053d289",
                 "speed": 81,
                 "penalty_points": 2,
-                "latitude": "34.749168",
-                "longitude": "32.569975"
+                "latitude": 34.749168,
+                "longitude": 32.569975
+            }
+        }
+
+
+class DriverPenaltySummaryModel(BaseModel):
+
+    driver_id: str
+    total_points: int
+    count: int
+    max_speed: Optional[int] = None
+    last_violation_at: Optional[datetime] = None
+    daily: Dict[str, Dict[str, int]] = dict()
+
+    @classmethod
+    def to_json(cls, entity, since=None):
+        if not entity:
+            return dict()
+
+        # keep daily buckets from the given day onwards
+        daily = entity.get("daily", dict())
+        if since:
+            daily = {day: bucket for day, bucket in daily.items() if day >= since}
+
+        return dict(
+            driver_id=entity["_id"],
+            total_points=entity["total_points"],
+            count=entity["count"],
+            max_speed=entity.get("max_speed"),
+            last_violation_at=entity.get("last_violation_at"),
+            daily=dict(sorted(daily.items()))
+        )
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "driver_id": "61e9d7fa22d8e7b0e053d289",
+                "total_points": 42,
+                "count": 5,
+                "max_speed": 112,
+                "last_violation_at": "2022-01-21T10:15:00",
+                "daily": {"2022-01-21": {"points": 42, "count": 5}}
+            }
+        }
+
+
+class DriverRiskModel(BaseModel):
+
+    rank: int
+    driver_id: str
+    first_name: Optional[str] = None
+    last_name: Optional[str] = None
+    score: int
+
+    @classmethod
+    def to_json(cls, entity, driver=None, rank=None):
+        if not entity:
+            return dict()
+
+        driver = driver or dict()
+        return dict(
+            rank=rank,
+            driver_id=entity["driver_id"],
+            first_name=driver.get("first_name"),
+            last_name=driver.get("last_name"),
+            score=entity["score"]
+        )
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "rank": 1,
+                "driver_id": "61e9d7fa22d8e7b0e053d289",
+                "first_name": "John",
+                "last_name": "Doe",
+                "score": 42
+            }
+        }
+
+
+class DriverOverviewModel(BaseModel):
+
+    id: str
+    first_name: str
+    last_name: str
+    age: int
+    gender: str
+    license_date: date
+    car: Optional[Dict[str, str]] = None
+    penalties: Dict[str, Any] = dict()
+
+    @classmethod
+    def to_json(cls, entity):
+        if not entity:
+            return dict()
+
+        # joined documents are single element arrays, or empty when there is nothing to join
+        cars = entity.get("car") or [None]
+        summaries = entity.get("summary") or [dict()]
+        return dict(
+            DriverModel.to_json(entity),
+            car=CarModel.to_json(cars[0]) if cars[0] else None,
+            penalties=dict(
+                total_points=summaries[0].get("total_points", 0),
+                count=summaries[0].get("count", 0),
+                max_speed=summaries[0].get("max_speed"),
+                last_violation_at=summaries[0].get("last_violation_at")
+            )
+        )
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "id": "61e9d7fa22d8e7b0e053d289",
+                "first_name": "John",
+                "last_name": "Doe",
+                "age": 30,
+                "gender": "Male",
+                "license_date": "2020-01-20",
+                "car": {"id": "61e9d81222d8e7b0e053d28a", "brand": "Mazda"},
+                "penalties": {
+                    "total_points": 42,
+                    "count": 5,
+                    "max_speed": 112,
+                    "last_violation_at": "2022-01-21T10:15:00"
+                }
             }
         }
@@ -0,0 +1,23 @@
+from typing import List
+
+from pydantic import BaseModel
+
+
+class GeoPolygonModel(BaseModel):
+
+    type: str = "Polygon"
+    coordinates: List[List[List[float]]]
+
+    class Config:
+        schema_extra = {
+            "example": {
+                "type": "Polygon",
+                "coordinates": [[
+                    [33.0, 34.9],
+                    [33.1, 34.9],
+                    [33.1, 35.0],
+                    [33.0, 35.0],
+                    [33.0, 34.9]
+                ]]
+            }
+        }
@@ -1,3 +1,4 @@
+from datetime import datetime
 from typing import Optional
 
 from pydantic import BaseModel
@@ -7,13 +8,30 @@ class TripModel(BaseModel):
 
     name: str
     description: Optional[str] = None
+    # trips detected by the consumer from the telemetry of a car
+    car_id: Optional[str] = None
+    driver_id: Optional[str] = None
+    started_at: Optional[datetime] = None
+    ended_at: Optional[datetime] = None
+    duration: Optional[float] = None
+    distance: Optional[float] = None
+    avg_speed: Optional[float] = None
+    max_speed: Optional[int] = None
+    start_latitude: Optional[float] = None
+    start_longitude: Optional[float] = None
+    end_latitude: Optional[float] = None
+    end_longitude: Optional[float] = None
 
     @classmethod
     def to_json(cls, entity):
         if not entity:
             return dict()
 
-        return dict(id=str(entity["_id"]), name=entity["name"], description=entity["description"])
+        data = dict(id=str(entity["_id"]), name=entity["name"], description=entity["description"])
+        for field in cls.__fields__:
+            if field not in data and entity.get(field) is not None:
+                data[field] = entity[field]
+        return data
 
     class Config:
         schema_extra = {
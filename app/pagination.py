@@ -0,0 +1,53 @@
+from bson import ObjectId
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+
+
+def get_projection(model, fields):
+    """ Translate a comma separated list of model fields to a MongoDB projection. """
+    if not fields:
+        return None
+
+    names = [name.strip() for name in fields.split(",") if name.strip()]
+    unknown = [name for name in names if name != "id" and name not in model.__fields__]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+
+    # entity id is always returned since it is used as the pagination cursor
+    projection = {"_id": 1}
+    projection.update({name: 1 for name in names if name != "id"})
+    return projection
+
+
+def to_projected_json(entity, projection):
+    """ Process a projected entity to json, only keeping the requested fields. """
+    data = dict(id=str(entity["_id"]))
+    data.update({name: entity.get(name) for name in projection if name != "_id"})
+    return data
+
+
+async def paginate(collection, model, after=None, limit=DEFAULT_PAGE_SIZE, fields=None):
+    """
+    Keyset pagination on `_id`. Returns at most `limit` entities with `_id` greater than the `after` cursor and the
+    cursor of the next page, if any.
+    """
+    projection = get_projection(model, fields)
+
+    query = dict()
+    if after:
+        query["_id"] = {"$gt": ObjectId(after)}
+
+    # fetch one extra entity to know whether there is a next page
+    cursor = collection.find(query, projection).sort("_id", 1).limit(limit + 1)
+    entities = await cursor.to_list(length=limit + 1)
+    has_next = len(entities) > limit
+    entities = entities[:limit]
+
+    # process entities to json
+    if projection:
+        data = [to_projected_json(entity, projection) for entity in entities]
+    else:
+        data = [model.to_json(entity) for entity in entities]
+
+    return {"data": data, "next": str(entities[-1]["_id"]) if has_next else None}
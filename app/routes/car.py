@@ -1,52 +1,102 @@
+from datetime import datetime
+from typing import Optional
+
 from bson import ObjectId
 from bson.errors import InvalidId
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, Request, status
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
-from database.database import fms_cars
-from app.models.car import CarModel
+from database.async_database import mongo
+from app.models.car import CarModel, CarSpeedModel
+from app.bulk import bulk_import, export_ndjson
+from app.cache import cache, get_cache_key
+from app.etag import build_etag, get_entity_version, get_etag, is_not_modified, mark_modified, not_modified
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate
 
 router = APIRouter()
 
 
 @router.post("/")
-def add_car(car: CarModel):
+async def add_car(car: CarModel):
     # convert car model data to json
     data = jsonable_encoder(car)
-    # insert car to db
-    entity = fms_cars.insert_one(data)
-    # get new car from db
-    new_entity = fms_cars.find_one({"_id": entity.inserted_id})
+    # insert car to db, the inserted id is set on data
+    await mongo.fms_cars.insert_one(data)
+    await mark_modified("fms_cars", entities=False)
 
-    return CarModel.to_json(new_entity)
+    return CarModel.to_json(data)
 
 
 @router.get("/")
-def get_all_cars():
-    # get all cars from the database
-    entities = fms_cars.find()
+async def get_all_cars(
+    request: Request,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None
+):
+    # the same page is returned while no car is written
+    etag = await get_etag("fms_cars", request.url.query)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    try:
+        # get next page of cars from the database
+        data = await paginate(mongo.fms_cars, CarModel, after=after, limit=limit, fields=fields)
+        return ORJSONResponse(data, headers={"ETag": etag})
+    except (InvalidId, ValueError) as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.post("/bulk")
+async def add_cars_bulk(request: Request):
+    try:
+        # validate and insert all cars of the NDJSON or JSON array body
+        return await bulk_import(mongo.fms_cars, CarModel, request)
+    except ValueError as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    finally:
+        # chunks may have been inserted before an invalid body was detected
+        await mark_modified("fms_cars", entities=False)
+
 
-    # process entities to json
-    data = [CarModel.to_json(entity) for entity in entities]
-    return data
+@router.get("/export")
+async def export_cars():
+    # stream all cars as NDJSON
+    return StreamingResponse(export_ndjson(mongo.reads.fms_cars, CarModel), media_type="application/x-ndjson")
 
 
 @router.get("/{id}")
-def get_car(id: str):
+async def get_car(id: str, request: Request):
     try:
-        # get car with given id
-        entity = fms_cars.find_one({"_id": ObjectId(id)})
+        # translate given id as ObjectId
+        entity_id = ObjectId(id)
     except InvalidId as e:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
+    # the body is cached per entity version, so it always matches the ETag it is served with
+    version = await get_entity_version("fms_cars")
+    etag = build_etag("fms_cars", version, entity_id)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    # get car from cache if any
+    data = await cache.get(get_cache_key("fms_cars", entity_id, version))
+    if data is not None:
+        return ORJSONResponse(data, headers={"ETag": etag})
+
+    # get car with given id
+    entity = await mongo.fms_cars.find_one({"_id": entity_id})
     if not entity:
         return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Car with ID '{id}' does not exist")
 
-    return CarModel.to_json(entity)
+    data = CarModel.to_json(entity)
+    await cache.set(get_cache_key("fms_cars", entity_id, version), data)
+    return ORJSONResponse(data, headers={"ETag": etag})
 
 
 @router.put("/{id}")
-def update_car(id: str, car: CarModel):
+async def update_car(id: str, car: CarModel):
     # convert car model data to json
     data = jsonable_encoder(car)
 
@@ -56,40 +106,52 @@ def update_car(id: str, car: CarModel):
     except InvalidId as e:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    # check if car exists with given id
-    entity = fms_cars.find_one({"_id": entity_id})
-    if not entity:
-        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Car with ID '{id}' does not exist")
-
     # update all car properties
-    updated_car = fms_cars.update_one({"_id": entity_id}, {"$set": data})
-    if updated_car:
+    result = await mongo.fms_cars.update_one({"_id": entity_id}, {"$set": data})
+    if result.modified_count:
+        await mark_modified("fms_cars")
+    if result.matched_count:
         return {"message": f"Car with ID '{id}' updated successfully"}
 
-    return HTTPException(
-        status_code=status.HTTP_400_BAD_REQUEST,
-        detail=f"An error occurred. There was an error updating the car with ID '{id}'"
-    )
+    # in case no car matched the given id
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Car with ID '{id}' does not exist")
 
 
 @router.delete("/{id}")
-def delete_car(id: str):
+async def delete_car(id: str):
     try:
         # translate given id as ObjectId
         entity_id = ObjectId(id)
     except InvalidId as e:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    # check car if exists before deletion
-    entity = fms_cars.find_one({"_id": entity_id})
-
-    # in case car does not exist then we do nothing
-    if not entity:
-        return None
-
     # delete car from database
-    deleted_car = fms_cars.delete_one({"_id": entity_id})
-    if deleted_car:
+    result = await mongo.fms_cars.delete_one({"_id": entity_id})
+    if result.deleted_count:
+        await mark_modified("fms_cars")
         return {"message": f"Car with ID '{id}' deleted successfully"}
 
+    # in case car does not exist then we do nothing
     return None
+
+
+@router.get("/{id}/speed")
+async def get_car_speed(
+    id: str,
+    start: datetime,
+    end: Optional[datetime] = None,
+    resolution: str = Query("minute", regex="^(raw|minute|hour)$"),
+    limit: int = Query(1440, ge=1, le=10000)
+):
+    # speed series until now unless end is given
+    end = end or datetime.utcnow()
+
+    if resolution == "raw":
+        query = {"meta.car_id": id, "timestamp": {"$gte": start, "$lt": end}}
+        entities = mongo.reads.fms_telemetry.find(query, {"timestamp": 1, "speed": 1}).sort("timestamp", 1)
+    else:
+        # downsampled series from the pre-computed rollups
+        collection = mongo.reads.fms_telemetry_minutely if resolution == "minute" else mongo.reads.fms_telemetry_hourly
+        entities = collection.find({"car_id": id, "bucket": {"$gte": start, "$lt": end}}).sort("bucket", 1)
+
+    return ORJSONResponse([CarSpeedModel.to_json(entity) async for entity in entities.limit(limit)])
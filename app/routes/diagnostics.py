@@ -0,0 +1,45 @@
+from anyio import to_thread
+from fastapi import APIRouter
+
+from database.monitoring import pool_metrics
+from database.settings import (
+    MONGO_COMPRESSORS, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_READ_PREFERENCE, MONGO_WAIT_QUEUE_TIMEOUT_MS
+)
+from app.cache import cache
+from app.stream import penalty_stream
+
+router = APIRouter()
+
+
+@router.get("/cache")
+async def get_cache_stats():
+    # entity cache hit ratio, size and evictions of this API worker
+    return await cache.stats()
+
+
+@router.get("/stream")
+async def get_stream_stats():
+    # penalty stream subscribers, broadcast events and events dropped for slow subscribers of this API worker
+    return penalty_stream.stats()
+
+
+@router.get("/pools")
+async def get_pool_stats():
+    # saturation of the threadpool and of the MongoDB connection pool of every server of this API worker
+    limiter = to_thread.current_default_thread_limiter()
+    statistics = limiter.statistics()
+    return dict(
+        threadpool=dict(
+            size=limiter.total_tokens,
+            in_use=statistics.borrowed_tokens,
+            waiting=statistics.tasks_waiting
+        ),
+        mongo=dict(
+            max_pool_size=MONGO_MAX_POOL_SIZE,
+            min_pool_size=MONGO_MIN_POOL_SIZE,
+            wait_queue_timeout_ms=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+            compressors=MONGO_COMPRESSORS,
+            read_preference=MONGO_READ_PREFERENCE,
+            servers=pool_metrics.stats()
+        )
+    )
@@ -1,52 +1,200 @@
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Optional
+
 from bson import ObjectId
 from bson.errors import InvalidId
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, Request, status
 from fastapi.encoders import jsonable_encoder
-
-from database.database import fms_drivers, fms_drivers_cars, fms_cars, fms_drivers_penalties
-from app.models.driver import DriverModel, DriverCarModel, DriverPenaltyModel
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+from database.async_database import mongo
+from database.leaderboard import WINDOWS
+from app.models.driver import (
+    DriverModel, DriverCarModel, DriverOverviewModel, DriverPenaltyModel, DriverPenaltySummaryModel, DriverRiskModel
+)
+from app.bulk import bulk_import, export_ndjson
+from app.cache import cache, get_cache_key
+from app.etag import build_etag, get_entity_version, get_etag, is_not_modified, mark_modified, not_modified
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate
 
 router = APIRouter()
 
+DUPLICATE_KEY_ERROR = 11000
+
 
 @router.post("/")
-def add_driver(driver: DriverModel):
+async def add_driver(driver: DriverModel):
     # convert driver model data to json
     data = jsonable_encoder(driver)
-    # insert driver to db
-    entity = fms_drivers.insert_one(data)
-    # get new driver from db
-    new_entity = fms_drivers.find_one({"_id": entity.inserted_id})
+    # insert driver to db, the inserted id is set on data
+    await mongo.fms_drivers.insert_one(data)
+    await mark_modified("fms_drivers", entities=False)
 
-    return DriverModel.to_json(new_entity)
+    return DriverModel.to_json(data)
 
 
 @router.get("/")
-def get_all_drivers():
-    # get all drivers from the database
-    entities = fms_drivers.find()
+async def get_all_drivers(
+    request: Request,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None
+):
+    # the same page is returned while no driver is written
+    etag = await get_etag("fms_drivers", request.url.query)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
 
-    # process entities to json
-    data = [DriverModel.to_json(entity) for entity in entities]
-    return data
+    try:
+        # get next page of drivers from the database
+        data = await paginate(mongo.fms_drivers, DriverModel, after=after, limit=limit, fields=fields)
+        return ORJSONResponse(data, headers={"ETag": etag})
+    except (InvalidId, ValueError) as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.post("/bulk")
+async def add_drivers_bulk(request: Request):
+    try:
+        # validate and insert all drivers of the NDJSON or JSON array body
+        return await bulk_import(mongo.fms_drivers, DriverModel, request)
+    except ValueError as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    finally:
+        # chunks may have been inserted before an invalid body was detected
+        await mark_modified("fms_drivers", entities=False)
+
+
+@router.get("/export")
+async def export_drivers():
+    # stream all drivers as NDJSON
+    return StreamingResponse(export_ndjson(mongo.reads.fms_drivers, DriverModel), media_type="application/x-ndjson")
+
+
+@router.get("/leaderboard")
+async def get_drivers_leaderboard(window: str = "24h", limit: int = Query(50, ge=1, le=MAX_PAGE_SIZE)):
+    if window not in WINDOWS:
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Window must be one of {', '.join(WINDOWS)}"
+        )
+
+    # top scores of the window, read in order from the window score index
+    entities = mongo.reads.fms_driver_risk_scores.find({"window": window}).sort("score", -1).limit(limit)
+    scores = await entities.to_list(None)
+
+    # names of the ranked drivers only
+    ids = [ObjectId(score["driver_id"]) for score in scores if ObjectId.is_valid(score["driver_id"])]
+    drivers = {
+        str(entity["_id"]): entity
+        async for entity in mongo.reads.fms_drivers.find({"_id": {"$in": ids}}, {"first_name": 1, "last_name": 1})
+    }
+
+    return ORJSONResponse([
+        DriverRiskModel.to_json(score, drivers.get(score["driver_id"]), rank=rank)
+        for rank, score in enumerate(scores, start=1)
+    ])
+
+
+def build_overview_pipeline(query, limit):
+    """
+    Drivers with their assigned car and penalty totals, joined on the server in a single aggregation. Every join
+    matches an indexed field of the joined collection.
+    """
+    return [
+        {"$match": query},
+        {"$sort": {"_id": 1}},
+        {"$limit": limit},
+        # assignments and summaries refer to drivers by their id as string
+        {"$set": {"driver_id": {"$toString": "$_id"}}},
+        {
+            "$lookup": {
+                "from": "fms_drivers_cars",
+                "localField": "driver_id",
+                "foreignField": "driver_id",
+                "as": "assignment"
+            }
+        },
+        {
+            "$set": {
+                "car_id": {
+                    "$convert": {
+                        "input": {"$arrayElemAt": ["$assignment.car_id", 0]},
+                        "to": "objectId",
+                        "onError": None,
+                        "onNull": None
+                    }
+                }
+            }
+        },
+        {"$lookup": {"from": "fms_cars", "localField": "car_id", "foreignField": "_id", "as": "car"}},
+        {
+            "$lookup": {
+                "from": "fms_drivers_penalty_summaries",
+                "localField": "driver_id",
+                "foreignField": "_id",
+                "as": "summary"
+            }
+        },
+        {"$unset": ["assignment", "car_id", "driver_id", "summary.daily"]}
+    ]
+
+
+@router.get("/overview")
+async def get_drivers_overview(
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE)
+):
+    try:
+        query = {"_id": {"$gt": ObjectId(after)}} if after else dict()
+    except InvalidId as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    # fetch one extra driver to know whether there is a next page
+    entities = await mongo.reads.fms_drivers.aggregate(build_overview_pipeline(query, limit + 1)).to_list(None)
+    has_next = len(entities) > limit
+    entities = entities[:limit]
+
+    return ORJSONResponse({
+        "data": [DriverOverviewModel.to_json(entity) for entity in entities],
+        "next": str(entities[-1]["_id"]) if has_next else None
+    })
 
 
 @router.get("/{id}")
-def get_driver(id: str):
+async def get_driver(id: str, request: Request):
     try:
-        # get driver with given id
-        entity = fms_drivers.find_one({"_id": ObjectId(id)})
+        # translate given id as ObjectId
+        entity_id = ObjectId(id)
     except InvalidId as e:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
+    # the body is cached per entity version, so it always matches the ETag it is served with
+    version = await get_entity_version("fms_drivers")
+    etag = build_etag("fms_drivers", version, entity_id)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    # get driver from cache if any
+    data = await cache.get(get_cache_key("fms_drivers", entity_id, version))
+    if data is not None:
+        return ORJSONResponse(data, headers={"ETag": etag})
+
+    # get driver with given id
+    entity = await mongo.fms_drivers.find_one({"_id": entity_id})
     if not entity:
         return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Driver with ID '{id}' does not exist")
 
-    return DriverModel.to_json(entity)
+    data = DriverModel.to_json(entity)
+    await cache.set(get_cache_key("fms_drivers", entity_id, version), data)
+    return ORJSONResponse(data, headers={"ETag": etag})
 
 
 @router.put("/{id}")
-def update_driver(id: str, driver: DriverModel):
+async def update_driver(id: str, driver: DriverModel):
     # convert driver model data to json
     data = jsonable_encoder(driver)
 
@@ -56,83 +204,201 @@ def update_driver(id: str, driver: DriverModel):
     except InvalidId as e:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    # check if driver exists with given id
-    entity = fms_drivers.find_one({"_id": entity_id})
-    if not entity:
-        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Driver with ID '{id}' does not exist")
-
     # update all driver properties
-    updated_driver = fms_drivers.update_one({"_id": entity_id}, {"$set": data})
-    if updated_driver:
+    result = await mongo.fms_drivers.update_one({"_id": entity_id}, {"$set": data})
+    if result.modified_count:
+        await mark_modified("fms_drivers")
+    if result.matched_count:
         return {"message": f"Driver with ID '{id}' updated successfully"}
 
-    return HTTPException(
-        status_code=status.HTTP_400_BAD_REQUEST,
-        detail=f"An error occurred. There was an error updating the driver with ID '{id}'"
-    )
+    # in case no driver matched the given id
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Driver with ID '{id}' does not exist")
 
 
 @router.delete("/{id}")
-def delete_driver(id: str):
+async def delete_driver(id: str):
     try:
         # translate given id as ObjectId
         entity_id = ObjectId(id)
     except InvalidId as e:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    # check driver if exists before deletion
-    entity = fms_drivers.find_one({"_id": entity_id})
-
-    # in case driver does not exist then we do nothing
-    if not entity:
-        return None
-
     # delete driver from database
-    deleted_driver = fms_drivers.delete_one({"_id": entity_id})
-    if deleted_driver:
+    result = await mongo.fms_drivers.delete_one({"_id": entity_id})
+    if result.deleted_count:
+        await mark_modified("fms_drivers")
         return {"message": f"Driver with ID '{id}' deleted successfully"}
 
+    # in case driver does not exist then we do nothing
     return None
 
 
+async def find_existing_ids(collection, ids):
+    """ Returns the ids of the given entities that exist in the collection """
+    entities = collection.find({"_id": {"$in": [ObjectId(id) for id in ids]}}, {"_id": 1})
+    return {str(entity["_id"]) async for entity in entities}
+
+
+async def find_missing_entities(driver_ids, car_ids):
+    """ Returns the ids of drivers and cars that do not exist, looking both up concurrently """
+    drivers, cars = await asyncio.gather(
+        find_existing_ids(mongo.fms_drivers, driver_ids),
+        find_existing_ids(mongo.fms_cars, car_ids)
+    )
+    return set(driver_ids) - drivers, set(car_ids) - cars
+
+
+@router.post("/assignments")
+async def assign_drivers_to_cars(assignments: List[DriverCarModel]):
+    errors = []
+    valid = []
+    for index, assignment in enumerate(assignments):
+        try:
+            # normalize ids the same way they are returned by the database
+            valid.append((index, str(ObjectId(assignment.driver_id)), str(ObjectId(assignment.car_id))))
+        except InvalidId as e:
+            errors.append({"index": index, "error": str(e)})
+
+    missing_drivers, missing_cars = await find_missing_entities(
+        list({driver_id for _, driver_id, _ in valid}),
+        list({car_id for _, _, car_id in valid})
+    )
+
+    requests = []
+    indexes = []
+    for index, driver_id, car_id in valid:
+        if driver_id in missing_drivers:
+            errors.append({"index": index, "error": f"Driver with ID '{driver_id}' does not exist"})
+        elif car_id in missing_cars:
+            errors.append({"index": index, "error": f"Car with ID '{car_id}' does not exist"})
+        else:
+            query = {"driver_id": driver_id, "car_id": None}
+            requests.append(UpdateOne(query, {"$set": {"car_id": car_id}}, upsert=True))
+            indexes.append(index)
+
+    # assign all pairs with a single unordered write, the unique driver_id index rejects drivers that have a car
+    assigned = 0
+    if requests:
+        try:
+            result = await mongo.fms_drivers_cars.bulk_write(requests, ordered=False)
+            assigned = result.upserted_count + result.modified_count
+        except BulkWriteError as e:
+            assigned = e.details.get("nUpserted", 0) + e.details.get("nModified", 0)
+            for error in e.details.get("writeErrors", []):
+                index = indexes[error["index"]]
+                driver_id = assignments[index].driver_id
+                if error["code"] == DUPLICATE_KEY_ERROR:
+                    errors.append({"index": index, "error": f"Driver with ID '{driver_id}' already assigned to a car"})
+                else:
+                    errors.append({"index": index, "error": error.get("errmsg")})
+
+    return {"assigned": assigned, "failed": len(errors), "errors": sorted(errors, key=lambda error: error["index"])}
+
+
 @router.post("/{driver_id}/car/{car_id}")
-def assign_driver_to_car(driver_id: str, car_id: str):
+async def assign_driver_to_car(driver_id: str, car_id: str):
     try:
-        # get driver with given id
-        driver = fms_drivers.find_one({"_id": ObjectId(driver_id)})
-        if not driver:
-            return HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"Driver with ID '{driver_id}' does not exist"
-            )
+        # get driver and car with given ids
+        missing_drivers, missing_cars = await find_missing_entities([driver_id], [car_id])
+    except InvalidId as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-        # get car with given id
-        car = fms_cars.find_one({"_id": ObjectId(car_id)})
-        if not car:
-            return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Car with ID '{car_id}' does not exist")
+    if missing_drivers:
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Driver with ID '{driver_id}' does not exist"
+        )
 
-        # check if driver already assigned a car
-        driver_car = fms_drivers_cars.find_one({"driver_id": driver_id, "car_id": {"$ne": None}})
-        if driver_car:
-            return HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail=f"Driver with ID '{driver_id}' already assigned to a car"
-            )
+    if missing_cars:
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Car with ID '{car_id}' does not exist")
 
-        # in case driver does not have a car assign the requested pair
-        entity = fms_drivers_cars.insert_one({"driver_id": driver_id, "car_id": car_id})
-        # get new driver car entity
-        new_entity = fms_drivers_cars.find_one({"_id": entity.inserted_id})
-        return DriverCarModel.to_json(new_entity)
+    try:
+        # assign the requested pair in case driver does not have a car, the unique driver_id index makes the check
+        # and the assignment a single atomic operation
+        entity = await mongo.fms_drivers_cars.find_one_and_update(
+            {"driver_id": str(ObjectId(driver_id)), "car_id": None},
+            {"$set": {"car_id": str(ObjectId(car_id))}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        return HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Driver with ID '{driver_id}' already assigned to a car"
+        )
+
+    return DriverCarModel.to_json(entity)
+
+
+@router.put("/{driver_id}/car/{car_id}")
+async def reassign_driver_to_car(driver_id: str, car_id: str):
+    try:
+        # get driver and car with given ids
+        missing_drivers, missing_cars = await find_missing_entities([driver_id], [car_id])
+    except InvalidId as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if missing_drivers:
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Driver with ID '{driver_id}' does not exist"
+        )
+
+    if missing_cars:
+        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Car with ID '{car_id}' does not exist")
+
+    query = {"driver_id": str(ObjectId(driver_id))}
+    update = {"$set": {"car_id": str(ObjectId(car_id))}}
+    try:
+        # replace driver car, or assign one in case driver does not have a car
+        entity = await mongo.fms_drivers_cars.find_one_and_update(
+            query, update, upsert=True, return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # a concurrent request inserted the assignment first, update it instead
+        entity = await mongo.fms_drivers_cars.find_one_and_update(query, update, return_document=ReturnDocument.AFTER)
+
+    return DriverCarModel.to_json(entity)
+
+
+@router.delete("/{driver_id}/car")
+async def unassign_driver_from_car(driver_id: str):
+    try:
+        # delete driver car assignment, ids are stored the same way they are returned by the database
+        result = await mongo.fms_drivers_cars.delete_one({"driver_id": str(ObjectId(driver_id))})
     except InvalidId as e:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
+    if result.deleted_count:
+        return {"message": f"Driver with ID '{driver_id}' unassigned successfully"}
+
+    # in case driver does not have a car then we do nothing
+    return None
+
+
+@router.get("/{driver_id}/overview")
+async def get_driver_overview(driver_id: str):
+    try:
+        # get driver with assigned car and penalty totals
+        pipeline = build_overview_pipeline({"_id": ObjectId(driver_id)}, 1)
+    except InvalidId as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    entities = await mongo.reads.fms_drivers.aggregate(pipeline).to_list(None)
+    if not entities:
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Driver with ID '{driver_id}' does not exist"
+        )
+
+    return ORJSONResponse(DriverOverviewModel.to_json(entities[0]))
+
 
 @router.get("/{driver_id}/penalties")
-def get_driver_penalties(driver_id: str):
+async def get_driver_penalties(driver_id: str):
     try:
         # get driver with given id
-        driver = fms_drivers.find_one({"_id": ObjectId(driver_id)})
+        driver = await mongo.reads.fms_drivers.find_one({"_id": ObjectId(driver_id)})
         if not driver:
             return HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -140,14 +406,37 @@ def get_driver_penalties(driver_id: str):
             )
 
         # get all driver penalties
-        entities = fms_drivers_penalties.find({"driver_id": driver_id})
+        entities = mongo.reads.fms_drivers_penalties.find({"driver_id": driver_id})
 
         # process entities to json
         data = []
-        for entity in entities:
+        async for entity in entities:
             entity_json = DriverPenaltyModel.to_json(entity)
             data.append(entity_json)
 
-        return data
+        return ORJSONResponse(data)
     except InvalidId as e:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.get("/{driver_id}/penalties/summary")
+async def get_driver_penalties_summary(driver_id: str, days: int = Query(30, ge=0)):
+    # get pre-aggregated driver penalties
+    entity = await mongo.reads.fms_drivers_penalty_summaries.find_one({"_id": driver_id})
+    if entity:
+        since = (datetime.utcnow().date() - timedelta(days=days)).isoformat()
+        return DriverPenaltySummaryModel.to_json(entity, since=since)
+
+    try:
+        # in case driver has no penalties check that driver exists
+        driver = await mongo.reads.fms_drivers.find_one({"_id": ObjectId(driver_id)}, {"_id": 1})
+    except InvalidId as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if not driver:
+        return HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Driver with ID '{driver_id}' does not exist"
+        )
+
+    return DriverPenaltySummaryModel.to_json({"_id": driver_id, "total_points": 0, "count": 0})
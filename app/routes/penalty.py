@@ -0,0 +1,146 @@
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, status
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, StreamingResponse
+
+from database.async_database import mongo
+from database.geo import EARTH_RADIUS, to_bbox_polygon
+from app.models.driver import DriverPenaltyModel
+from app.models.penalty import GeoPolygonModel
+from app.stream import penalty_stream, stream_events
+
+router = APIRouter()
+
+MAX_RESULTS = 1000
+
+
+def parse_bbox_bounds(bbox):
+    """ Parse a `min_longitude,min_latitude,max_longitude,max_latitude` bounding box """
+    try:
+        min_longitude, min_latitude, max_longitude, max_latitude = (float(value) for value in bbox.split(","))
+    except ValueError:
+        raise ValueError("Bounding box must be given as min_longitude,min_latitude,max_longitude,max_latitude")
+
+    return min_longitude, min_latitude, max_longitude, max_latitude
+
+
+def parse_bbox(bbox):
+    """ Translate a `min_longitude,min_latitude,max_longitude,max_latitude` bounding box to a GeoJSON polygon """
+    return to_bbox_polygon(*parse_bbox_bounds(bbox))
+
+
+async def find_penalties(query, driver_id, limit):
+    """ Find penalties matching a geospatial query, optionally of a single driver """
+    if driver_id:
+        query["driver_id"] = driver_id
+
+    entities = mongo.reads.fms_drivers_penalties.find(query).limit(limit)
+    return ORJSONResponse([DriverPenaltyModel.to_json(entity) async for entity in entities])
+
+
+@router.get("/near")
+async def get_penalties_near(
+    latitude: float = Query(..., ge=-90, le=90),
+    longitude: float = Query(..., ge=-180, le=180),
+    radius: float = Query(..., gt=0, description="Radius in metres"),
+    driver_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_RESULTS)
+):
+    # get penalties within radius metres of the given point
+    query = {"location": {"$geoWithin": {"$centerSphere": [[longitude, latitude], radius / EARTH_RADIUS]}}}
+    return await find_penalties(query, driver_id, limit)
+
+
+@router.get("/within")
+async def get_penalties_within_bbox(
+    bbox: str = Query(..., description="min_longitude,min_latitude,max_longitude,max_latitude"),
+    driver_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_RESULTS)
+):
+    try:
+        polygon = parse_bbox(bbox)
+    except ValueError as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    # get penalties inside the bounding box
+    return await find_penalties({"location": {"$geoWithin": {"$geometry": polygon}}}, driver_id, limit)
+
+
+@router.post("/within")
+async def get_penalties_within_polygon(
+    polygon: GeoPolygonModel,
+    driver_id: Optional[str] = None,
+    limit: int = Query(100, ge=1, le=MAX_RESULTS)
+):
+    # get penalties inside the polygon
+    query = {"location": {"$geoWithin": {"$geometry": jsonable_encoder(polygon)}}}
+    return await find_penalties(query, driver_id, limit)
+
+
+@router.get("/stream")
+async def stream_penalties(
+    driver_id: Optional[str] = None,
+    bbox: Optional[str] = Query(None, description="min_longitude,min_latitude,max_longitude,max_latitude")
+):
+    try:
+        bounds = parse_bbox_bounds(bbox) if bbox else None
+    except ValueError as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    if not penalty_stream.supported:
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Penalty streams require MongoDB to run as a replica set"
+        )
+
+    # push new penalties of the driver and area as server-sent events
+    return StreamingResponse(
+        stream_events(penalty_stream, driver_id=driver_id, bounds=bounds),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@router.get("/heatmap")
+async def get_penalties_heatmap(
+    bbox: str = Query(..., description="min_longitude,min_latitude,max_longitude,max_latitude"),
+    cell: float = Query(0.01, gt=0, le=10, description="Grid cell size in degrees"),
+    driver_id: Optional[str] = None
+):
+    try:
+        polygon = parse_bbox(bbox)
+    except ValueError as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    query = {"location": {"$geoWithin": {"$geometry": polygon}}}
+    if driver_id:
+        query["driver_id"] = driver_id
+
+    # count penalties and sum penalty points per grid cell inside the bounding box
+    entities = mongo.reads.fms_drivers_penalties.aggregate([
+        {"$match": query},
+        {
+            "$group": {
+                "_id": {
+                    "x": {"$floor": {"$divide": [{"$arrayElemAt": ["$location.coordinates", 0]}, cell]}},
+                    "y": {"$floor": {"$divide": [{"$arrayElemAt": ["$location.coordinates", 1]}, cell]}}
+                },
+                "count": {"$sum": 1},
+                "penalty_points": {"$sum": "$penalty_points"}
+            }
+        },
+        {"$sort": {"count": -1}},
+        {"$limit": MAX_RESULTS}
+    ])
+
+    # process grid cells to json, cells are identified by their center
+    return ORJSONResponse([
+        dict(
+            latitude=(entity["_id"]["y"] + 0.5) * cell,
+            longitude=(entity["_id"]["x"] + 0.5) * cell,
+            count=entity["count"],
+            penalty_points=entity["penalty_points"]
+        )
+        async for entity in entities
+    ])
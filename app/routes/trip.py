@@ -1,52 +1,101 @@
+from typing import Optional
+
 from bson import ObjectId
 from bson.errors import InvalidId
-from fastapi import APIRouter, HTTPException, status
+from fastapi import APIRouter, HTTPException, Query, Request, status
 from fastapi.encoders import jsonable_encoder
+from fastapi.responses import ORJSONResponse, StreamingResponse
 
-from database.database import fms_trips
+from database.async_database import mongo
 from app.models.trip import TripModel
+from app.bulk import bulk_import, export_ndjson
+from app.cache import cache, get_cache_key
+from app.etag import build_etag, get_entity_version, get_etag, is_not_modified, mark_modified, not_modified
+from app.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, paginate
 
 router = APIRouter()
 
 
 @router.post("/")
-def add_trip(trip: TripModel):
+async def add_trip(trip: TripModel):
     # convert trip model data to json
     data = jsonable_encoder(trip)
-    # insert trip to db
-    entity = fms_trips.insert_one(data)
-    # get new trip from db
-    new_entity = fms_trips.find_one({"_id": entity.inserted_id})
+    # insert trip to db, the inserted id is set on data
+    await mongo.fms_trips.insert_one(data)
+    await mark_modified("fms_trips", entities=False)
 
-    return TripModel.to_json(new_entity)
+    return TripModel.to_json(data)
 
 
 @router.get("/")
-def get_all_trips():
-    # get all trips from the database
-    entities = fms_trips.find()
+async def get_all_trips(
+    request: Request,
+    after: Optional[str] = None,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+    fields: Optional[str] = None
+):
+    # the same page is returned while no trip is written
+    etag = await get_etag("fms_trips", request.url.query)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    try:
+        # get next page of trips from the database
+        data = await paginate(mongo.fms_trips, TripModel, after=after, limit=limit, fields=fields)
+        return ORJSONResponse(data, headers={"ETag": etag})
+    except (InvalidId, ValueError) as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.post("/bulk")
+async def add_trips_bulk(request: Request):
+    try:
+        # validate and insert all trips of the NDJSON or JSON array body
+        return await bulk_import(mongo.fms_trips, TripModel, request)
+    except ValueError as e:
+        return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    finally:
+        # chunks may have been inserted before an invalid body was detected
+        await mark_modified("fms_trips", entities=False)
 
-    # process entities to json
-    data = [TripModel.to_json(entity) for entity in entities]
-    return data
+
+@router.get("/export")
+async def export_trips():
+    # stream all trips as NDJSON
+    return StreamingResponse(export_ndjson(mongo.reads.fms_trips, TripModel), media_type="application/x-ndjson")
 
 
 @router.get("/{id}")
-def get_trip(id: str):
+async def get_trip(id: str, request: Request):
     try:
-        # get trip with given id
-        entity = fms_trips.find_one({"_id": ObjectId(id)})
+        # translate given id as ObjectId
+        entity_id = ObjectId(id)
     except InvalidId as e:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
+    # the body is cached per entity version, so it always matches the ETag it is served with
+    version = await get_entity_version("fms_trips")
+    etag = build_etag("fms_trips", version, entity_id)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    # get trip from cache if any
+    data = await cache.get(get_cache_key("fms_trips", entity_id, version))
+    if data is not None:
+        return ORJSONResponse(data, headers={"ETag": etag})
+
+    # get trip with given id
+    entity = await mongo.fms_trips.find_one({"_id": entity_id})
     if not entity:
         return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Trip with ID '{id}' does not exist")
 
-    return TripModel.to_json(entity)
+    data = TripModel.to_json(entity)
+    await cache.set(get_cache_key("fms_trips", entity_id, version), data)
+    return ORJSONResponse(data, headers={"ETag": etag})
 
 
 @router.put("/{id}")
-def update_trip(id: str, trip: TripModel):
+async def update_trip(id: str, trip: TripModel):
     # convert car model data to json
     data = jsonable_encoder(trip)
 
@@ -56,39 +105,30 @@ def update_trip(id: str, trip: TripModel):
     except InvalidId as e:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    entity = fms_trips.find_one({"_id": entity_id})
-    if not entity:
-        return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Trip with ID '{id}' does not exist")
-
     # update all trip properties
-    updated_trip = fms_trips.update_one({"_id": entity_id}, {"$set": data})
-    if updated_trip:
+    result = await mongo.fms_trips.update_one({"_id": entity_id}, {"$set": data})
+    if result.modified_count:
+        await mark_modified("fms_trips")
+    if result.matched_count:
         return {"message": f"Trip with ID '{id}' updated successfully"}
 
-    return HTTPException(
-        status_code=status.HTTP_400_BAD_REQUEST,
-        detail=f"An error occurred. There was an error updating the trip with ID '{id}'"
-    )
+    # in case no trip matched the given id
+    return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"Trip with ID '{id}' does not exist")
 
 
 @router.delete("/{id}")
-def delete_trip(id: str):
+async def delete_trip(id: str):
     try:
         # translate given id as ObjectId
         entity_id = ObjectId(id)
     except InvalidId as e:
         return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
-    # check trip if exists before deletion
-    entity = fms_trips.find_one({"_id": entity_id})
-
-    # in case car does not exist then we do nothing
-    if not entity:
-        return None
-
-    # delete car from database
-    deleted_trip = fms_trips.delete_one({"_id": entity_id})
-    if deleted_trip:
+    # delete trip from database
+    result = await mongo.fms_trips.delete_one({"_id": entity_id})
+    if result.deleted_count:
+        await mark_modified("fms_trips")
         return {"message": f"Trip with ID {id} deleted successfully"}
 
+    # in case trip does not exist then we do nothing
     return None
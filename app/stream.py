@@ -0,0 +1,157 @@
+import asyncio
+import logging
+from collections import defaultdict
+
+import orjson
+from decouple import config
+from pymongo.errors import OperationFailure, PyMongoError
+
+from database.async_database import mongo
+from database.settings import CHANGE_STREAMS_NOT_SUPPORTED
+from app.models.driver import DriverPenaltyModel
+
+logger = logging.getLogger(__name__)
+
+STREAM_QUEUE_SIZE = config("STREAM_QUEUE_SIZE", default=100, cast=int)
+STREAM_HEARTBEAT_INTERVAL = config("STREAM_HEARTBEAT_INTERVAL", default=15, cast=int)
+STREAM_RETRY_DELAY = config("STREAM_RETRY_DELAY", default=5, cast=int)
+
+
+class Subscription(object):
+    """ A single stream client. Events are buffered in a bounded queue and dropped once the client falls behind. """
+
+    def __init__(self, driver_id=None, bounds=None, queue_size=STREAM_QUEUE_SIZE):
+        self.driver_id = driver_id
+        self.bounds = bounds
+        self.queue = asyncio.Queue(maxsize=queue_size)
+        self.dropped = 0
+
+    def matches(self, penalty):
+        """ Whether a penalty is inside the `(min_longitude, min_latitude, max_longitude, max_latitude)` bounds """
+        if self.bounds is None:
+            return True
+
+        min_longitude, min_latitude, max_longitude, max_latitude = self.bounds
+        return (
+            min_longitude <= penalty["longitude"] <= max_longitude
+            and min_latitude <= penalty["latitude"] <= max_latitude
+        )
+
+    def offer(self, event):
+        """ Buffer an event without waiting, a full queue drops the event instead of blocking other clients """
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += 1
+            return False
+
+
+class PenaltyBroadcaster(object):
+    """
+    Watches new penalties with a single change stream and fans them out to all subscribers of this API worker.
+    Subscribers are indexed by driver, so an event only visits the subscribers of its driver and the ones without
+    a driver filter. Every event is serialized once, whatever the number of subscribers.
+    """
+
+    def __init__(self):
+        self._subscriptions = defaultdict(set)
+        self._task = None
+        self._resume_token = None
+        self.supported = True
+        self.events = 0
+        self.dropped = 0
+
+    def start(self):
+        self._task = asyncio.get_event_loop().create_task(self.watch())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+        self._task = None
+
+    def subscribe(self, driver_id=None, bounds=None):
+        subscription = Subscription(driver_id=driver_id, bounds=bounds)
+        self._subscriptions[driver_id].add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        subscriptions = self._subscriptions.get(subscription.driver_id)
+        if subscriptions is None:
+            return
+
+        subscriptions.discard(subscription)
+        if not subscriptions:
+            del self._subscriptions[subscription.driver_id]
+
+    def publish(self, entity):
+        """ Hand a penalty over to every matching subscriber """
+        penalty = DriverPenaltyModel.to_json(entity)
+        event = (penalty["id"], orjson.dumps(penalty))
+        self.events += 1
+
+        for driver_id in (None, entity["driver_id"]):
+            for subscription in self._subscriptions.get(driver_id, ()):
+                if subscription.matches(penalty) and not subscription.offer(event):
+                    self.dropped += 1
+
+    async def watch(self):
+        """
+        Follow inserted penalties, resuming after the last seen event when the change stream fails. Servers without
+        change streams disable the broadcaster once instead of retrying forever.
+        """
+        pipeline = [{"$match": {"operationType": "insert"}}]
+        while True:
+            try:
+                async with mongo.fms_drivers_penalties.watch(pipeline, resume_after=self._resume_token) as stream:
+                    async for change in stream:
+                        self._resume_token = stream.resume_token
+                        self.publish(change["fullDocument"])
+            except PyMongoError as e:
+                if isinstance(e, OperationFailure) and e.code == CHANGE_STREAMS_NOT_SUPPORTED:
+                    logger.error(f"Penalty streams are disabled, change streams require a replica set: {e}")
+                    self.supported = False
+                    return
+                logger.error(f"Penalty change stream failed, retrying in {STREAM_RETRY_DELAY} s: {e}")
+                await asyncio.sleep(STREAM_RETRY_DELAY)
+
+    def stats(self):
+        return dict(
+            running=self._task is not None and not self._task.done(),
+            supported=self.supported,
+            subscribers=sum(len(subscriptions) for subscriptions in self._subscriptions.values()),
+            events=self.events,
+            dropped=self.dropped
+        )
+
+
+async def stream_events(broadcaster, driver_id=None, bounds=None):
+    """
+    Server-sent events of new penalties, with a comment line as heartbeat while no penalty arrives. The subscription
+    lives as long as the response is streamed.
+    """
+    subscription = broadcaster.subscribe(driver_id=driver_id, bounds=bounds)
+    try:
+        while True:
+            try:
+                id, data = await asyncio.wait_for(subscription.queue.get(), timeout=STREAM_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                yield b": heartbeat\n\n"
+                continue
+
+            if subscription.dropped:
+                # let the client know that it missed events because it did not keep up
+                yield b"event: dropped\ndata: " + orjson.dumps({"count": subscription.dropped}) + b"\n\n"
+                subscription.dropped = 0
+
+            yield b"id: " + id.encode("utf8") + b"\ndata: " + data + b"\n\n"
+    finally:
+        broadcaster.unsubscribe(subscription)
+
+
+penalty_stream = PenaltyBroadcaster()
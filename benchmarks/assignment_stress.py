@@ -0,0 +1,101 @@
+"""
+Concurrent stress test of driver to car assignment. Creates drivers and cars through the API, fires many concurrent
+assignment requests per driver to different cars and checks that every driver ends up with exactly one car.
+Reports per-assignment latency and removes the created entities afterwards.
+
+    python -m benchmarks.assignment_stress --url http://localhost:80 --drivers 100 --attempts 20 --concurrency 64
+"""
+import argparse
+import http.client
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+from benchmarks.load_test import percentile
+
+
+class Client(object):
+    """ Minimal JSON client keeping one keep-alive connection per thread """
+
+    def __init__(self, url):
+        self._url = urlparse(url)
+        self._local = threading.local()
+
+    def request(self, method, path, body=None):
+        if not hasattr(self._local, "connection"):
+            self._local.connection = http.client.HTTPConnection(self._url.hostname, self._url.port or 80, timeout=30)
+
+        headers = dict()
+        if body is not None:
+            headers["Content-Type"] = "application/json"
+            body = json.dumps(body)
+
+        self._local.connection.request(method, path, body=body, headers=headers)
+        response = self._local.connection.getresponse()
+        return json.loads(response.read() or "null")
+
+
+def is_assigned(response):
+    """ Assignment routes return the assignment on success and the error details otherwise """
+    return isinstance(response, dict) and "id" in response and "status_code" not in response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:80")
+    parser.add_argument("--drivers", type=int, default=100)
+    parser.add_argument("--cars", type=int, default=100)
+    parser.add_argument("--attempts", type=int, default=20, help="concurrent assignment requests per driver")
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+
+    client = Client(args.url)
+    driver = {"first_name": "Stress", "last_name": "Test", "age": 30, "gender": "Male", "license_date": "2020-01-01"}
+    driver_ids = [client.request("POST", "/drivers/", driver)["id"] for _ in range(args.drivers)]
+    car_ids = [client.request("POST", "/cars/", {"brand": "Stress"})["id"] for _ in range(args.cars)]
+
+    def assign(driver_id):
+        start = time.perf_counter()
+        response = client.request("POST", f"/drivers/{driver_id}/car/{random.choice(car_ids)}")
+        return driver_id, is_assigned(response), time.perf_counter() - start
+
+    attempts = [driver_id for driver_id in driver_ids for _ in range(args.attempts)]
+    random.shuffle(attempts)
+
+    try:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+            results = list(executor.map(assign, attempts))
+        elapsed = time.perf_counter() - start
+    finally:
+        for driver_id in driver_ids:
+            client.request("DELETE", f"/drivers/{driver_id}/car")
+            client.request("DELETE", f"/drivers/{driver_id}")
+        for car_id in car_ids:
+            client.request("DELETE", f"/cars/{car_id}")
+
+    assignments = {driver_id: 0 for driver_id in driver_ids}
+    for driver_id, assigned, _ in results:
+        assignments[driver_id] += assigned
+
+    latencies = sorted(latency * 1000 for *_, latency in results)
+    print(f"{len(results)} assignment requests in {elapsed:.2f} s ({len(results) / elapsed:.0f} req/s)")
+    print(
+        f"Latency p50 {percentile(latencies, 50):.2f} ms, p95 {percentile(latencies, 95):.2f} ms, "
+        f"p99 {percentile(latencies, 99):.2f} ms"
+    )
+
+    inconsistent = {driver_id: count for driver_id, count in assignments.items() if count != 1}
+    if inconsistent:
+        print(f"{len(inconsistent)} drivers were not assigned exactly one car: {inconsistent}")
+        sys.exit(1)
+
+    print("Every driver was assigned exactly one car")
+
+
+if __name__ == "__main__":
+    main()
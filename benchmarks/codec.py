@@ -0,0 +1,53 @@
+"""
+Compare the JSON and binary telemetry encodings. Reports bytes per reading and encode and decode throughput of
+single reading messages and of multi-reading frames.
+
+    python -m benchmarks.codec --readings 100000 --frame-size 100
+"""
+import argparse
+import time
+
+from bson import ObjectId
+
+from messaging.codec import CONTENT_TYPE_BINARY, CONTENT_TYPE_JSON, decode, encode
+from publisher.publisher import Publisher
+
+
+def build_frames(readings, frame_size):
+    return [readings[index:index + frame_size] for index in range(0, len(readings), frame_size)]
+
+
+def timed(func, items):
+    start = time.perf_counter()
+    results = [func(item) for item in items]
+    return results, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--readings", type=int, default=100_000)
+    parser.add_argument("--frame-size", type=int, default=100)
+    args = parser.parse_args()
+
+    readings = [Publisher.build_message(str(ObjectId())) for _ in range(args.readings)]
+
+    print(f"{'encoding':>16} {'bytes/reading':>14} {'encode/s':>12} {'decode/s':>12}")
+    for name, content_type, frame_size in (
+        ("json", CONTENT_TYPE_JSON, 1),
+        ("json frame", CONTENT_TYPE_JSON, args.frame_size),
+        ("binary", CONTENT_TYPE_BINARY, 1),
+        ("binary frame", CONTENT_TYPE_BINARY, args.frame_size)
+    ):
+        frames = build_frames(readings, frame_size)
+        messages, encode_time = timed(lambda frame: encode(frame, content_type), frames)
+        decoded, decode_time = timed(lambda message: decode(message, content_type), messages)
+        assert sum(len(frame) for frame in decoded) == len(readings)
+
+        size = sum(len(message) for message in messages) / len(readings)
+        print(
+            f"{name:>16} {size:>14.1f} {len(readings) / encode_time:>12.0f} {len(readings) / decode_time:>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compare MongoDB time spent per write request before and after removing the read-after-write and existence-check
+round trips of the CRUD routes. Runs against a scratch collection that is dropped afterwards.
+
+    MONGO_CONNECTION_STRING=mongodb://localhost:27017/?directConnection=true python -m benchmarks.crud_roundtrips --requests 2000
+"""
+import argparse
+import time
+
+from database.database import db
+
+COLLECTION = "fms_benchmark_cars"
+
+
+def create_before(collection, data):
+    entity = collection.insert_one(dict(data))
+    return collection.find_one({"_id": entity.inserted_id})
+
+
+def create_after(collection, data):
+    data = dict(data)
+    collection.insert_one(data)
+    return data
+
+
+def update_before(collection, entity_id, data):
+    if collection.find_one({"_id": entity_id}):
+        return collection.update_one({"_id": entity_id}, {"$set": data})
+
+
+def update_after(collection, entity_id, data):
+    return collection.update_one({"_id": entity_id}, {"$set": data}).matched_count
+
+
+def delete_before(collection, entity_id):
+    if collection.find_one({"_id": entity_id}):
+        return collection.delete_one({"_id": entity_id})
+
+
+def delete_after(collection, entity_id):
+    return collection.delete_one({"_id": entity_id}).deleted_count
+
+
+def run(collection, requests, create, update, delete):
+    """ Average milliseconds per create, update and delete request """
+    timings = dict(create=0.0, update=0.0, delete=0.0)
+    for index in range(requests):
+        start = time.perf_counter()
+        entity = create(collection, {"brand": f"Brand {index}"})
+        timings["create"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        update(collection, entity["_id"], {"brand": f"Brand {index} updated"})
+        timings["update"] += time.perf_counter() - start
+
+        start = time.perf_counter()
+        delete(collection, entity["_id"])
+        timings["delete"] += time.perf_counter() - start
+
+    return {operation: total / requests * 1000 for operation, total in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=2000)
+    args = parser.parse_args()
+
+    collection = db.get_collection(COLLECTION)
+    try:
+        # warm up connection pool
+        run(collection, 100, create_after, update_after, delete_after)
+
+        before = run(collection, args.requests, create_before, update_before, delete_before)
+        after = run(collection, args.requests, create_after, update_after, delete_after)
+    finally:
+        collection.drop()
+
+    print(f"{'operation':>10} {'before ms':>10} {'after ms':>10} {'ratio':>7}")
+    for operation, before_time in before.items():
+        after_time = after[operation]
+        print(f"{operation:>10} {before_time:>10.3f} {after_time:>10.3f} {after_time / before_time:>7.2f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Compare building the overview of a driver from several API calls with the single aggregation of
+`GET /drivers/{id}/overview`, and paging through `GET /drivers/overview`. Creates drivers and cars through the API,
+assigns every driver a car and removes the created entities afterwards.
+
+The multi-call path already knows the car of every driver, there is no route to read a single assignment, so it
+issues one call less than a client would.
+
+    python -m benchmarks.driver_overview --url http://localhost:80 --drivers 1000 --concurrency 16
+"""
+import argparse
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks.assignment_stress import Client
+from benchmarks.load_test import percentile
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return (time.perf_counter() - start) * 1000
+
+
+def report(name, latencies, elapsed):
+    latencies = sorted(latencies)
+    print(
+        f"{name:>12} {elapsed:>9.2f} {percentile(latencies, 50):>9.2f} {percentile(latencies, 95):>9.2f} "
+        f"{percentile(latencies, 99):>9.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:80")
+    parser.add_argument("--drivers", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--page-size", type=int, default=100)
+    args = parser.parse_args()
+
+    client = Client(args.url)
+    driver = {"first_name": "Bench", "last_name": "Mark", "age": 30, "gender": "Male", "license_date": "2020-01-01"}
+
+    def create(path, body):
+        return client.request("POST", path, body)["id"]
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        driver_ids = list(executor.map(create, ["/drivers/"] * args.drivers, [driver] * args.drivers))
+        car_ids = list(executor.map(create, ["/cars/"] * args.drivers, [{"brand": "Bench"}] * args.drivers))
+    cars = dict(zip(driver_ids, car_ids))
+    client.request(
+        "POST", "/drivers/assignments", [{"driver_id": id, "car_id": car_id} for id, car_id in cars.items()]
+    )
+
+    def multi_call(driver_id):
+        client.request("GET", f"/drivers/{driver_id}")
+        client.request("GET", f"/cars/{cars[driver_id]}")
+        client.request("GET", f"/drivers/{driver_id}/penalties/summary")
+
+    def overview(driver_id):
+        client.request("GET", f"/drivers/{driver_id}/overview")
+
+    def overview_pages():
+        after = ""
+        while after is not None:
+            page = client.request("GET", f"/drivers/overview?limit={args.page_size}&after={after}")
+            after = page["next"] or None
+
+    try:
+        print(f"{'path':>12} {'total ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for name, func in (("multi-call", multi_call), ("overview", overview)):
+            start = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                latencies = list(executor.map(lambda driver_id: timed(func, driver_id), driver_ids))
+            report(name, latencies, (time.perf_counter() - start) * 1000)
+
+        elapsed = timed(overview_pages)
+        print(f"Paged through all driver overviews, {args.page_size} per page, in {elapsed:.2f} ms")
+    finally:
+        for driver_id in driver_ids:
+            client.request("DELETE", f"/drivers/{driver_id}/car")
+            client.request("DELETE", f"/drivers/{driver_id}")
+        for car_id in car_ids:
+            client.request("DELETE", f"/cars/{car_id}")
+
+
+if __name__ == "__main__":
+    main()
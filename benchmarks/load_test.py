@@ -0,0 +1,76 @@
+"""
+HTTP load test for the API. Runs a fixed number of requests against a path at increasing concurrency levels and
+reports throughput and latency percentiles for each level.
+
+    python -m benchmarks.load_test --url http://localhost:80 --path /drivers/ --concurrency 1 16 64 256
+"""
+import argparse
+import http.client
+import statistics
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+
+def percentile(samples, pct):
+    """ Nearest-rank percentile of an already sorted list """
+    if not samples:
+        return 0.0
+    index = min(len(samples) - 1, max(0, int(round(pct / 100 * len(samples))) - 1))
+    return samples[index]
+
+
+def run_level(url, path, concurrency, requests):
+    """ Run `requests` GET requests with `concurrency` keep-alive connections """
+    parsed = urlparse(url)
+    local = threading.local()
+
+    def request(_):
+        # every worker thread keeps its own keep-alive connection
+        if not hasattr(local, "connection"):
+            local.connection = http.client.HTTPConnection(parsed.hostname, parsed.port or 80, timeout=30)
+
+        start = time.perf_counter()
+        local.connection.request("GET", path)
+        response = local.connection.getresponse()
+        response.read()
+        return time.perf_counter() - start, response.status
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(request, range(requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = sorted(latency * 1000 for latency, _ in results)
+    errors = sum(1 for _, code in results if code >= 500)
+    return dict(
+        concurrency=concurrency,
+        throughput=requests / elapsed,
+        mean=statistics.mean(latencies),
+        p50=percentile(latencies, 50),
+        p95=percentile(latencies, 95),
+        p99=percentile(latencies, 99),
+        errors=errors
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:80")
+    parser.add_argument("--path", default="/drivers/")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64, 256])
+    args = parser.parse_args()
+
+    print(f"{'concurrency':>11} {'req/s':>10} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'5xx':>5}")
+    for concurrency in args.concurrency:
+        result = run_level(args.url, args.path, concurrency, args.requests)
+        print(
+            f"{result['concurrency']:>11} {result['throughput']:>10.1f} {result['mean']:>9.2f} "
+            f"{result['p50']:>9.2f} {result['p95']:>9.2f} {result['p99']:>9.2f} {result['errors']:>5}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,251 @@
+"""
+Synthetic fleet load generator and end-to-end consumer benchmark.
+
+Seeds a synthetic fleet of car assignments, publishes telemetry in the Publisher message format at a target rate
+from several publisher processes and consumes it with one Consumer worker per shard. Every second it reports
+publish and consume rates, queue depth and end-to-end latency percentiles, measured from the `published_at`
+timestamp embedded in every message.
+
+Run against local RabbitMQ and MongoDB instances, e.g. the ones of docker-compose:
+
+    docker-compose up -d mongodb rabbitmq
+    AMQP_URL=amqp://localhost MONGO_CONNECTION_STRING=mongodb://localhost:27017/?directConnection=true \\
+        python -m benchmarks.loadgen --cars 10000 --rate 50000 --publishers 4 --duration 60
+
+Rates are readings per second. With `--format binary --frame-size 50` every message holds a frame of up to 50
+readings of cars of the same shard.
+"""
+import argparse
+import multiprocessing
+import queue
+import random
+import time
+
+import pika
+from bson import ObjectId
+from decouple import config
+
+from benchmarks.load_test import percentile
+from messaging.codec import encode, get_content_type
+from messaging.routing import SHARDS, get_shard_queue, get_shard_routing_key
+from publisher.publisher import Publisher
+
+REPORT_INTERVAL = 1
+LATENCY_SAMPLES = 2000
+LOADGEN_MARKER = "loadgen"
+
+
+def seed_fleet(cars):
+    """ Insert synthetic driver car assignments and return the car ids """
+    from database.database import fms_drivers_cars
+
+    car_ids = [str(ObjectId()) for _ in range(cars)]
+    fms_drivers_cars.insert_many(
+        [{"driver_id": str(ObjectId()), "car_id": car_id, LOADGEN_MARKER: True} for car_id in car_ids],
+        ordered=False
+    )
+    return car_ids
+
+
+def cleanup_fleet():
+    """ Remove synthetic assignments and everything the consumers derived from the readings of their cars """
+    from database.database import db, fms_drivers_cars
+
+    driver_ids = fms_drivers_cars.distinct("driver_id", {LOADGEN_MARKER: True})
+    car_ids = fms_drivers_cars.distinct("car_id", {LOADGEN_MARKER: True})
+    for name, filter in (
+        ("fms_drivers_penalties", {"driver_id": {"$in": driver_ids}}),
+        ("fms_drivers_penalty_summaries", {"_id": {"$in": driver_ids}}),
+        ("fms_driver_risk_buckets", {"driver_id": {"$in": driver_ids}}),
+        ("fms_driver_risk_scores", {"driver_id": {"$in": driver_ids}}),
+        ("fms_telemetry", {"meta.car_id": {"$in": car_ids}}),
+        ("fms_telemetry_minutely", {"car_id": {"$in": car_ids}}),
+        ("fms_telemetry_hourly", {"car_id": {"$in": car_ids}}),
+        ("fms_trips", {"car_id": {"$in": car_ids}}),
+        ("fms_trip_states", {"_id": {"$in": car_ids}})
+    ):
+        db.get_collection(name).delete_many(filter)
+    fms_drivers_cars.delete_many({LOADGEN_MARKER: True})
+
+
+def run_publisher(amqp_url, car_ids, rate, duration, results, content_type, frame_size):
+    """ Publisher process. Publish `rate` readings per second round robin over frames of the given cars. """
+    connection = pika.BlockingConnection(pika.URLParameters(amqp_url))
+    channel = connection.channel()
+    properties = pika.BasicProperties(content_type=content_type)
+    frames = Publisher.build_frames(car_ids, frame_size)
+
+    deadline = time.monotonic() + duration
+    started = time.monotonic()
+    next_report = started + REPORT_INTERVAL
+    published = 0
+    reported = 0
+    index = 0
+
+    while time.monotonic() < deadline:
+        # publish in small slices to keep the rate steady
+        due = int((time.monotonic() - started) * rate) - published
+        while due > 0:
+            shard, frame = frames[index % len(frames)]
+            index += 1
+            message = encode([Publisher.build_message(car_id) for car_id in frame], content_type)
+            routing_key = get_shard_routing_key(Publisher.ROUTING_KEY, shard)
+            channel.basic_publish(
+                exchange=Publisher.EXCHANGE, routing_key=routing_key, body=message, properties=properties
+            )
+            published += len(frame)
+            due -= len(frame)
+
+        now = time.monotonic()
+        if now >= next_report:
+            results.put(("published", published - reported, []))
+            reported = published
+            next_report = now + REPORT_INTERVAL
+
+        connection.process_data_events(time_limit=0)
+        time.sleep(0.005)
+
+    results.put(("published", published - reported, []))
+    connection.close()
+
+
+def run_consumer(amqp_url, shard, results):
+    """ Consumer process. Run a Consumer on the given shard and report consumed readings and their latency. """
+    from consumer.consumer import Consumer
+
+    class InstrumentedConsumer(Consumer):
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self._consumed = 0
+            self._latencies = []
+            self._next_report = time.monotonic() + REPORT_INTERVAL
+
+        def flush_batch(self):
+            batch = self._batch
+            super().flush_batch()
+
+            now = time.time()
+            self._consumed += len(batch)
+            self._latencies.extend((now - data["published_at"]) * 1000 for _, data in batch if "published_at" in data)
+
+            if time.monotonic() >= self._next_report:
+                if len(self._latencies) > LATENCY_SAMPLES:
+                    self._latencies = random.sample(self._latencies, LATENCY_SAMPLES)
+                results.put(("consumed", self._consumed, self._latencies))
+                self._consumed = 0
+                self._latencies = []
+                self._next_report = time.monotonic() + REPORT_INTERVAL
+
+    InstrumentedConsumer(amqp_url=amqp_url, shard=shard).run()
+
+
+def get_queue_depth(channel):
+    """ Total number of ready messages over all shard queues """
+    return sum(
+        channel.queue_declare(queue=get_shard_queue(Publisher.QUEUE, shard), passive=True).method.message_count
+        for shard in range(SHARDS)
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--amqp-url", default=config("AMQP_URL"))
+    parser.add_argument("--cars", type=int, default=1000, help="simulated fleet size")
+    parser.add_argument("--rate", type=int, default=1000, help="target readings per second over all publishers")
+    parser.add_argument("--publishers", type=int, default=1, help="number of publisher processes")
+    parser.add_argument("--duration", type=int, default=30, help="publishing duration in seconds")
+    parser.add_argument("--format", choices=("json", "binary"), default="json", help="telemetry message format")
+    parser.add_argument("--frame-size", type=int, default=1, help="readings per message")
+    parser.add_argument("--drain-timeout", type=int, default=30, help="seconds to wait for consumers to drain")
+    parser.add_argument("--keep", action="store_true", help="keep the synthetic fleet and its data afterwards")
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context("spawn")
+    results = context.Queue()
+
+    print(f"Seeding {args.cars} cars")
+    car_ids = seed_fleet(args.cars)
+
+    # consumers first, so that shard queues exist before anything is published
+    consumers = [context.Process(target=run_consumer, args=(args.amqp_url, shard, results)) for shard in range(SHARDS)]
+    for process in consumers:
+        process.start()
+    time.sleep(3)
+
+    publishers = [
+        context.Process(
+            target=run_publisher,
+            args=(
+                args.amqp_url, car_ids[index::args.publishers], args.rate / args.publishers, args.duration, results,
+                get_content_type(args.format), args.frame_size
+            )
+        )
+        for index in range(args.publishers)
+    ]
+    for process in publishers:
+        process.start()
+
+    connection = pika.BlockingConnection(pika.URLParameters(args.amqp_url))
+    channel = connection.channel()
+
+    started = time.monotonic()
+    total_published = 0
+    total_consumed = 0
+    all_latencies = []
+
+    print(f"{'time s':>7} {'pub/s':>10} {'cons/s':>10} {'depth':>10} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    try:
+        while True:
+            published = 0
+            consumed = 0
+            latencies = []
+            deadline = time.monotonic() + REPORT_INTERVAL
+            while time.monotonic() < deadline:
+                try:
+                    kind, count, samples = results.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if kind == "published":
+                    published += count
+                else:
+                    consumed += count
+                    latencies.extend(samples)
+
+            total_published += published
+            total_consumed += consumed
+            all_latencies.extend(latencies)
+            latencies.sort()
+
+            depth = get_queue_depth(channel)
+            elapsed = time.monotonic() - started
+            print(
+                f"{elapsed:>7.1f} {published:>10} {consumed:>10} {depth:>10} {percentile(latencies, 50):>9.1f} "
+                f"{percentile(latencies, 95):>9.1f} {percentile(latencies, 99):>9.1f}"
+            )
+
+            publishing = any(process.is_alive() for process in publishers)
+            if not publishing and (depth == 0 or elapsed > args.duration + args.drain_timeout):
+                break
+    finally:
+        for process in consumers:
+            process.terminate()
+        connection.close()
+
+        if not args.keep:
+            cleanup_fleet()
+
+    elapsed = time.monotonic() - started
+    all_latencies.sort()
+    print(
+        f"\nPublished {total_published} readings, consumed {total_consumed} readings in {elapsed:.1f} s "
+        f"({total_consumed / elapsed:.0f} readings/s sustained)"
+    )
+    print(
+        f"End-to-end latency p50 {percentile(all_latencies, 50):.1f} ms, p95 {percentile(all_latencies, 95):.1f} ms, "
+        f"p99 {percentile(all_latencies, 99):.1f} ms, max {all_latencies[-1] if all_latencies else 0:.1f} ms"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""
+Compare the vectorized penalty scoring against scoring one message at a time.
+
+    python -m benchmarks.penalty_scoring --sizes 10000 100000 1000000
+"""
+import argparse
+import time
+
+import numpy as np
+
+from consumer.penalties import DEFAULT_PENALTY_RULES, PenaltyRules
+
+
+def legacy_penalty_points(speed):
+    """ Hard-coded rules the penalty table replaces """
+    if 60 < speed <= 80:
+        return 80 - speed
+    elif 80 < speed <= 100:
+        return (100 - speed) * 2
+    elif speed > 100:
+        return (speed - 100) * 5
+
+    return 0
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rules = PenaltyRules(DEFAULT_PENALTY_RULES)
+    generator = np.random.default_rng(args.seed)
+
+    print(f"{'readings':>10} {'loop ms':>10} {'batch ms':>10} {'speedup':>8}")
+
+    # warm up numpy before timing
+    rules.score(np.arange(1000))
+
+    for size in args.sizes:
+        speeds = generator.integers(0, 201, size=size).tolist()
+
+        expected, loop_time = timed(lambda values: [legacy_penalty_points(speed) for speed in values], speeds)
+        points, batch_time = timed(rules.score, speeds)
+
+        # the rule table must reproduce the hard-coded rules exactly
+        assert points.tolist() == expected, "vectorized penalty points differ from the per-message rules"
+
+        print(f"{size:>10} {loop_time * 1000:>10.2f} {batch_time * 1000:>10.2f} {loop_time / batch_time:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+"""
+Compare the serialization cost of large list responses. The default FastAPI path runs the handler result through
+`jsonable_encoder` and the stdlib json encoder, the optimized path serializes the `to_json` output with orjson.
+
+    python -m benchmarks.serialization --items 10000 --repeat 20
+"""
+import argparse
+import json
+import time
+from datetime import datetime
+
+import orjson
+from bson import ObjectId
+from fastapi.encoders import jsonable_encoder
+
+from app.models.driver import DriverModel, DriverPenaltyModel
+
+
+def build_drivers(items):
+    return [
+        {
+            "_id": ObjectId(),
+            "first_name": f"First {index}",
+            "last_name": f"Last {index}",
+            "age": 20 + index % 50,
+            "gender": "Male" if index % 2 else "Female",
+            "license_date": "2020-01-20"
+        }
+        for index in range(items)
+    ]
+
+
+def build_penalties(items):
+    return [
+        {
+            "_id": ObjectId(),
+            "driver_id": str(ObjectId()),
+            "speed": 60 + index % 100,
+            "penalty_points": index % 50,
+            "latitude": 34.749168,
+            "longitude": 32.569975,
+            "created_at": datetime.utcnow()
+        }
+        for index in range(items)
+    ]
+
+
+def stdlib_response(data):
+    """ Serialization done by FastAPI's default JSONResponse """
+    return json.dumps(
+        jsonable_encoder(data), ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def orjson_response(data):
+    """ Serialization done by ORJSONResponse when the handler returns the response itself """
+    return orjson.dumps(data)
+
+
+def timed(func, data, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func(data)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--items", type=int, default=10_000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+
+    print(f"{'response':>12} {'stdlib ms':>10} {'orjson ms':>10} {'speedup':>8}")
+    for name, model, entities in (
+        ("drivers", DriverModel, build_drivers(args.items)),
+        ("penalties", DriverPenaltyModel, build_penalties(args.items))
+    ):
+        data = [model.to_json(entity) for entity in entities]
+        before = timed(stdlib_response, data, args.repeat)
+        after = timed(orjson_response, data, args.repeat)
+        print(f"{name:>12} {before:>10.2f} {after:>10.2f} {before / after:>7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
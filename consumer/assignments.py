@@ -0,0 +1,163 @@
+import logging
+import threading
+
+from decouple import config
+from pymongo.errors import OperationFailure, PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+class AssignmentCache(object):
+    """
+    Local car_id -> driver_id map of the driver car assignments. The map is loaded in bulk on start and kept
+    current through a change stream on the assignments collection. When change streams are not available (e.g.
+    standalone MongoDB servers) the map is fully reloaded periodically instead.
+
+    While the change stream is open the map is authoritative and cars missing from it are unassigned. Otherwise
+    cars that were looked up and found unassigned are remembered until the next reload.
+    """
+
+    RELOAD_INTERVAL = config("ASSIGNMENT_CACHE_RELOAD_INTERVAL", default=60, cast=int)
+    RETRY_INTERVAL = 5
+
+    def __init__(self, collection):
+        self._collection = collection
+        self._drivers = dict()
+        self._cars = dict()
+        self._unassigned = set()
+        self._live = False
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+
+    def start(self):
+        """ Load all assignments and start watching for changes in the background. """
+        self.load()
+        self._thread = threading.Thread(target=self.watch, name="assignment-cache", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """ Stop watching for assignment changes. """
+        self._stopping.set()
+
+    def load(self):
+        """ Replace the local map with all assignments stored in the database. """
+        drivers = dict()
+        cars = dict()
+        for entity in self._collection.find({"car_id": {"$ne": None}, "driver_id": {"$ne": None}}):
+            drivers[entity["car_id"]] = str(entity["driver_id"])
+            cars[entity["_id"]] = entity["car_id"]
+
+        with self._lock:
+            self._drivers = drivers
+            self._cars = cars
+            self._unassigned = set()
+
+        self.refreshes += 1
+        logger.info(f"Loaded {len(drivers)} car assignments")
+
+    def watch(self):
+        """ Apply assignment changes from the change stream, falling back to periodic reloads. """
+        while not self._stopping.is_set():
+            try:
+                with self._collection.watch(full_document="updateLookup", max_await_time_ms=1000) as stream:
+                    # reload since changes may have been missed while the stream was not open
+                    self.load()
+                    self._live = True
+                    while stream.alive and not self._stopping.is_set():
+                        change = stream.try_next()
+                        if change is not None:
+                            self.apply_change(change)
+                    self._live = False
+            except OperationFailure as e:
+                self._live = False
+                logger.warning(f"Change streams are not available, reloading assignments periodically: {e}")
+                while not self._stopping.wait(self.RELOAD_INTERVAL):
+                    self.reload()
+            except PyMongoError as e:
+                self._live = False
+                logger.warning(f"Assignment change stream failed, reopening: {e}")
+                self._stopping.wait(self.RETRY_INTERVAL)
+
+    def reload(self):
+        """ Reload all assignments, keeping the current map on failure. """
+        try:
+            self.load()
+        except PyMongoError as e:
+            logger.warning(f"Failed to reload assignments: {e}")
+
+    def apply_change(self, change):
+        """ Apply a single change stream event to the local map. """
+        operation = change["operationType"]
+        if operation in ("insert", "update", "replace"):
+            if change.get("fullDocument"):
+                self.put(change["fullDocument"])
+            else:
+                # document was deleted before the update could be looked up
+                self.remove(change["documentKey"]["_id"])
+        elif operation == "delete":
+            self.remove(change["documentKey"]["_id"])
+        else:
+            # drop, rename or invalidate events, start over from the database
+            self.load()
+
+    def put(self, entity):
+        """ Add or replace an assignment in the local map. """
+        with self._lock:
+            self._remove(entity["_id"])
+            if entity.get("car_id") and entity.get("driver_id"):
+                self._drivers[entity["car_id"]] = str(entity["driver_id"])
+                self._cars[entity["_id"]] = entity["car_id"]
+                self._unassigned.discard(entity["car_id"])
+
+    def remove(self, entity_id):
+        """ Remove an assignment from the local map. """
+        with self._lock:
+            self._remove(entity_id)
+
+    def _remove(self, entity_id):
+        car_id = self._cars.pop(entity_id, None)
+        if car_id is not None:
+            self._drivers.pop(car_id, None)
+
+    def get_many(self, car_ids):
+        """
+        Returns the car_id -> driver_id map of the given cars. Unless the change stream keeps the local map complete,
+        cars missing from it that are not known to be unassigned are looked up in the database with a single query.
+        """
+        live = self._live
+        drivers = dict()
+        missing = []
+        for car_id in car_ids:
+            driver_id = self._drivers.get(car_id)
+            if driver_id is not None:
+                drivers[car_id] = driver_id
+            elif not live and car_id not in self._unassigned:
+                missing.append(car_id)
+
+        self.hits += len(car_ids) - len(missing)
+        self.misses += len(missing)
+
+        if missing:
+            for entity in self._collection.find({"car_id": {"$in": missing}, "driver_id": {"$ne": None}}):
+                self.put(entity)
+                drivers[entity["car_id"]] = str(entity["driver_id"])
+
+            # remember cars without a driver until the next reload
+            with self._lock:
+                self._unassigned.update(car_id for car_id in missing if car_id not in drivers)
+
+        return drivers
+
+    def stats(self):
+        """ Returns cache counters to be reported in logs. """
+        return dict(
+            size=len(self._drivers),
+            unassigned=len(self._unassigned),
+            hits=self.hits,
+            misses=self.misses,
+            refreshes=self.refreshes
+        )
@@ -1,15 +1,31 @@
-import json
 import logging
 import sys
+import time
+from datetime import datetime
 
 import pika
 from decouple import config
 from pika.exchange_type import ExchangeType
-
-from database.database import fms_drivers_cars, fms_drivers_penalties
+from prometheus_client import start_http_server
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from consumer.assignments import AssignmentCache
+from consumer.leaderboard import expire_leaderboard, update_leaderboard
+from consumer.metrics import ACK_LAG, DB_WRITE_DURATION, FLUSHED_BATCH_SIZE, MESSAGES, UNASSIGNED_MESSAGES
+from consumer.penalties import PenaltyRules
+from consumer.summaries import update_penalty_summaries
+from consumer.telemetry import store_telemetry
+from consumer.trips import TripTracker
+from database.database import db, fms_drivers_cars, fms_drivers_penalties, fms_drivers_penalty_summaries
+from database.geo import to_point
+from database.indexes import ensure_indexes
+from messaging.codec import decode, get_reading_id
+from messaging.routing import get_shard_queue, get_shard_routing_key
 
 logger = logging.getLogger(__name__)
 
+DUPLICATE_KEY_ERROR = 11000
+
 
 class Consumer(object):
 
@@ -17,12 +33,30 @@ class Consumer(object):
     EXCHANGE_TYPE = ExchangeType.topic
     QUEUE = "FMS"
     ROUTING_KEY = "FMS.exchange"
-
-    def __init__(self, amqp_url):
+    BATCH_SIZE = config("CONSUMER_BATCH_SIZE", default=1, cast=int)
+    BATCH_TIMEOUT_MS = config("CONSUMER_BATCH_TIMEOUT_MS", default=100, cast=int)
+    PREFETCH_COUNT = max(config("CONSUMER_PREFETCH_COUNT", default=1, cast=int), BATCH_SIZE)
+    STATS_INTERVAL = config("CONSUMER_STATS_INTERVAL", default=60, cast=int)
+    TELEMETRY_ENABLED = config("TELEMETRY_ENABLED", default=False, cast=bool)
+    TRIPS_ENABLED = config("TRIPS_ENABLED", default=False, cast=bool)
+    TRIP_EXPIRY_INTERVAL = config("TRIP_EXPIRY_INTERVAL", default=60, cast=int)
+    LEADERBOARD_EXPIRY_INTERVAL = config("LEADERBOARD_EXPIRY_INTERVAL", default=60, cast=int)
+    # every shard worker serves its metrics on the base port plus its shard, 0 disables metrics
+    METRICS_PORT = config("CONSUMER_METRICS_PORT", default=9100, cast=int)
+
+    def __init__(self, amqp_url, shard=0):
         self._url = amqp_url
+        self._shard = shard
+        self._queue = get_shard_queue(self.QUEUE, shard)
+        self._routing_key = get_shard_routing_key(self.ROUTING_KEY, shard)
         self._connection = None
         self._channel = None
         self._consumer_tag = None
+        self._batch = []
+        self._flush_timer = None
+        self._assignments = AssignmentCache(fms_drivers_cars)
+        self._penalty_rules = PenaltyRules.from_config()
+        self._trips = TripTracker(db, shard=shard)
 
     def connect(self):
         """ Connect to RabbitMQ server """
@@ -50,14 +84,14 @@ class Consumer(object):
 
     def on_exchange_declareok(self, *args, **kwargs):
         """ Invoked by pika when RabbitMQ finished with declaring the exchange. Declare channel queue. """
-        self._channel.queue_declare(queue=self.QUEUE, callback=self.on_queue_declareok)
+        self._channel.queue_declare(queue=self._queue, callback=self.on_queue_declareok)
 
     def on_queue_declareok(self, *args, **kwargs):
         """ Bind the queue and exchange together. """
         self._channel.queue_bind(
-            queue=self.QUEUE,
+            queue=self._queue,
             exchange=self.EXCHANGE,
-            routing_key=self.ROUTING_KEY,
+            routing_key=self._routing_key,
             callback=self.on_bindok
         )
 
@@ -66,57 +100,221 @@ class Consumer(object):
         self.set_channel_qos()
 
     def set_channel_qos(self):
-        """ Sets up the consumer prefetch to only be delivered one message at a time """
-        self._channel.basic_qos(prefetch_count=1, callback=self.on_basic_qos_ok)
+        """ Sets up the consumer prefetch window, at least one batch of messages is delivered at a time """
+        self._channel.basic_qos(prefetch_count=self.PREFETCH_COUNT, callback=self.on_basic_qos_ok)
 
     def on_basic_qos_ok(self, *args, **kwargs):
         """ Invoked by pika when the basic qos method has completed. Start consuming messages from queue """
         self.start_consuming()
+        self.schedule_stats()
+        if self.TRIPS_ENABLED:
+            self.schedule_trip_expiry()
+        self.expire_leaderboard()
+
+    def schedule_stats(self):
+        """ Schedule logging of consumer statistics in interval seconds. """
+        self._connection.ioloop.call_later(self.STATS_INTERVAL, self.log_stats)
+
+    def log_stats(self):
+        """ Log assignment cache and trip counters. """
+        stats = self._assignments.stats()
+        logger.info(
+            f"Assignment cache: {stats['size']} cars, {stats['unassigned']} unassigned, {stats['hits']} hits, "
+            f"{stats['misses']} misses, {stats['refreshes']} refreshes"
+        )
+        if self.TRIPS_ENABLED:
+            stats = self._trips.stats()
+            logger.info(f"Trips: {stats['open']} open, {stats['opened']} opened, {stats['closed']} closed")
+        self.schedule_stats()
+
+    def schedule_trip_expiry(self):
+        """ Schedule closing of trips of cars that stopped reporting in interval seconds. """
+        self._connection.ioloop.call_later(self.TRIP_EXPIRY_INTERVAL, self.expire_trips)
+
+    def expire_trips(self):
+        """ Close and store the trips of cars that have not been moving for longer than the idle timeout. """
+        self._trips.expire(datetime.utcnow())
+        self._trips.save()
+        self.schedule_trip_expiry()
+
+    def expire_leaderboard(self):
+        """ Subtract buckets that slid out of the leaderboard windows from the scores and schedule the next run. """
+        expire_leaderboard(db)
+        self._connection.ioloop.call_later(self.LEADERBOARD_EXPIRY_INTERVAL, self.expire_leaderboard)
 
     def start_consuming(self):
         """ Starts basic queue consuming from RabbitMQ server. """
-        self._consumer_tag = self._channel.basic_consume(queue=self.QUEUE, on_message_callback=self.consume_message)
+        self._consumer_tag = self._channel.basic_consume(queue=self._queue, on_message_callback=self.consume_message)
 
     def stop_consuming(self):
         """ Terminate queue consumer with RabbitMQ server. """
         if self._channel:
+            self.flush_batch()
             self._channel.basic_cancel(self._consumer_tag, callback=self.close_channel)
 
     def consume_message(self, channel, method, properties, body):
-        logger.info(f"Received message {body}")
-        data = json.loads(body)
-
-        car_id = data["car_id"]
-        speed = int(data["speed"])
-        latitude = data["latitude"]
-        longitude = data["longitude"]
-
-        # find driver
-        entity = fms_drivers_cars.find_one({"car_id": car_id})
-        driver_id = str(entity["driver_id"])
-
-        # calculate penalty points if any
-        penalty_points = 0
-
-        if 60 < speed <= 80:
-            penalty_points = 80 - speed
-        elif 80 < speed <= 100:
-            penalty_points = (100 - speed) * 2
-        elif speed > 100:
-            penalty_points = (speed - 100) * 5
-
-        if penalty_points > 0:
-            # store penalty points if any
-            fms_drivers_penalties.insert_one({
-                "driver_id": driver_id,
-                "speed": speed,
-                "penalty_points": penalty_points,
-                "latitude": latitude,
-                "longitude": longitude
-            })
-
-        logger.info(f"Acknowledge message {method.delivery_tag}")
-        self._channel.basic_ack(method.delivery_tag)
+        """ Buffer the readings of a received message until the batch is full or the batch timeout expires. """
+        logger.debug(f"Received message {body}")
+        try:
+            readings = decode(body, properties.content_type)
+        except (ValueError, KeyError) as e:
+            # messages that cannot be decoded would fail the same way on every redelivery
+            logger.error(f"Rejecting malformed message {method.delivery_tag}: {e}")
+            self._channel.basic_reject(method.delivery_tag, requeue=False)
+            MESSAGES.labels(self._shard, "rejected").inc()
+            return
+
+        if not readings:
+            self._channel.basic_ack(method.delivery_tag)
+            MESSAGES.labels(self._shard, "acked").inc()
+            return
+
+        self._batch.extend((method.delivery_tag, data) for data in readings)
+
+        if len(self._batch) >= self.BATCH_SIZE:
+            self.flush_batch()
+        elif self._flush_timer is None:
+            self._flush_timer = self._connection.ioloop.call_later(self.BATCH_TIMEOUT_MS / 1000, self.on_flush_timeout)
+
+    def on_flush_timeout(self):
+        """ Invoked by pika when the batch timeout expired before the batch was full. """
+        self._flush_timer = None
+        self.flush_batch()
+
+    def flush_batch(self):
+        """ Calculate and store penalty points of all buffered messages and acknowledge them. """
+        if self._flush_timer is not None:
+            self._connection.ioloop.remove_timeout(self._flush_timer)
+            self._flush_timer = None
+
+        batch, self._batch = self._batch, []
+        if not batch:
+            return
+
+        FLUSHED_BATCH_SIZE.labels(self._shard).observe(len(batch))
+
+        # find drivers of all cars in the batch from the local assignments map
+        drivers = self._assignments.get_many({data["car_id"] for _, data in batch})
+
+        readings = []
+        reading_ids = []
+        positions = dict()
+        for delivery_tag, data in batch:
+            # position of the reading in its message, readings of a message are buffered in order
+            index = positions.get(delivery_tag, 0)
+            positions[delivery_tag] = index + 1
+
+            car_id = data["car_id"]
+            driver_id = drivers.get(car_id)
+            if driver_id is None:
+                logger.warning(f"Car with ID '{car_id}' is not assigned to a driver, dropping message {delivery_tag}")
+                UNASSIGNED_MESSAGES.labels(self._shard).inc()
+                continue
+
+            # violation time is the time the reading was taken
+            timestamp = datetime.utcfromtimestamp(data["published_at"])
+            readings.append((delivery_tag, data, driver_id, timestamp, int(data["speed"])))
+            # redeliveries of a message produce the same reading ids
+            reading_ids.append(get_reading_id(data, index))
+
+        # calculate penalty points of the whole batch at once
+        points = self._penalty_rules.score([speed for *_, speed in readings]).tolist()
+
+        penalties = []
+        penalty_tags = []
+        for (delivery_tag, data, driver_id, timestamp, speed), penalty_points, reading_id in zip(
+            readings, points, reading_ids
+        ):
+            if penalty_points > 0:
+                penalties.append({
+                    "_id": reading_id,
+                    "driver_id": driver_id,
+                    "speed": speed,
+                    "penalty_points": penalty_points,
+                    "latitude": data["latitude"],
+                    "longitude": data["longitude"],
+                    "location": to_point(data["latitude"], data["longitude"]),
+                    "created_at": timestamp
+                })
+                penalty_tags.append(delivery_tag)
+
+        # store penalty points if any
+        with DB_WRITE_DURATION.labels(self._shard, "penalties").time():
+            inserted, failed_tags = self.store_penalties(penalties, penalty_tags)
+
+        # store all readings for speed history, readings stored by an earlier delivery are skipped
+        if self.TELEMETRY_ENABLED:
+            with DB_WRITE_DURATION.labels(self._shard, "telemetry").time():
+                store_telemetry(db, readings, reading_ids)
+
+        # extend the open trips of the cars, trip states are checkpointed before the readings are acknowledged
+        if self.TRIPS_ENABLED:
+            with DB_WRITE_DURATION.labels(self._shard, "trips").time():
+                self._trips.update(readings)
+                self._trips.save()
+
+        # only penalties inserted by this delivery are counted, whether their message is acknowledged or requeued
+        with DB_WRITE_DURATION.labels(self._shard, "summaries").time():
+            update_penalty_summaries(fms_drivers_penalty_summaries, inserted)
+        with DB_WRITE_DURATION.labels(self._shard, "leaderboard").time():
+            update_leaderboard(db, inserted)
+        # a message is acknowledged once, whatever the number of readings it holds
+        self.acknowledge(list(dict.fromkeys(delivery_tag for delivery_tag, _ in batch)), failed_tags)
+        self.observe_ack_lag([data for delivery_tag, data in batch if delivery_tag not in failed_tags])
+
+    @staticmethod
+    def store_penalties(penalties, delivery_tags):
+        """
+        Insert penalties with a single unordered bulk write. Returns the penalties inserted by this call and the
+        delivery tags of the messages whose penalty could not be stored. Penalties already stored by an earlier
+        delivery of their message are neither inserted nor failed.
+        """
+        if not penalties:
+            return [], set()
+
+        try:
+            fms_drivers_penalties.insert_many(penalties, ordered=False)
+        except BulkWriteError as e:
+            # unordered inserts keep going after an error, only the reported documents were not written
+            errors = e.details.get("writeErrors", [])
+            rejected = {error["index"] for error in errors}
+            failed_tags = {delivery_tags[error["index"]] for error in errors if error["code"] != DUPLICATE_KEY_ERROR}
+            if failed_tags:
+                logger.error(f"Failed to store {len(failed_tags)} of {len(penalties)} penalties")
+            return [penalty for index, penalty in enumerate(penalties) if index not in rejected], failed_tags
+        except PyMongoError as e:
+            logger.error(f"Failed to store {len(penalties)} penalties: {e}")
+            return [], set(delivery_tags)
+
+        return penalties, set()
+
+    def acknowledge(self, delivery_tags, failed_tags):
+        """
+        Acknowledge all messages of a batch with a single multiple ack. In case some messages failed, acknowledge
+        the successful ones one by one and requeue the failed ones.
+        """
+        if not failed_tags:
+            logger.info(f"Acknowledge {len(delivery_tags)} messages up to {delivery_tags[-1]}")
+            self._channel.basic_ack(delivery_tags[-1], multiple=True)
+            MESSAGES.labels(self._shard, "acked").inc(len(delivery_tags))
+            return
+
+        for delivery_tag in delivery_tags:
+            if delivery_tag in failed_tags:
+                self._channel.basic_nack(delivery_tag, requeue=True)
+            else:
+                self._channel.basic_ack(delivery_tag)
+
+        MESSAGES.labels(self._shard, "acked").inc(len(delivery_tags) - len(failed_tags))
+        MESSAGES.labels(self._shard, "requeued").inc(len(failed_tags))
+        logger.info(f"Acknowledge {len(delivery_tags) - len(failed_tags)} messages, requeue {len(failed_tags)}")
+
+    def observe_ack_lag(self, messages):
+        """ Record the time from publishing until acknowledgement of messages """
+        now = time.time()
+        histogram = ACK_LAG.labels(self._shard)
+        for data in messages:
+            histogram.observe(now - data["published_at"])
 
     def close_channel(self):
         """ Command to close the channel with RabbitMQ server. """
@@ -130,11 +328,19 @@ class Consumer(object):
 
     def stop(self):
         """ Terminate connection with RabbitMQ server. """
+        self._assignments.stop()
         self.stop_consuming()
 
     def run(self):
         """ Run consumer by connecting and starting the IOLoop. """
+        ensure_indexes(db)
+        if self.METRICS_PORT:
+            start_http_server(self.METRICS_PORT + self._shard)
+
         try:
+            self._assignments.start()
+            if self.TRIPS_ENABLED:
+                self._trips.load()
             self._connection = self.connect()
             self._connection.ioloop.start()
         except KeyboardInterrupt:
@@ -150,5 +356,5 @@ if __name__ == "__main__":
         handlers=[logging.StreamHandler(sys.stdout)]
     )
 
-    consumer = Consumer(amqp_url=config("AMQP_URL"))
+    consumer = Consumer(amqp_url=config("AMQP_URL"), shard=config("CONSUMER_SHARD", default=0, cast=int))
     consumer.run()
@@ -0,0 +1,149 @@
+import logging
+import sys
+from datetime import datetime
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import PyMongoError
+
+from database.leaderboard import BUCKET_SIZE, WINDOWS, get_bucket
+
+logger = logging.getLogger(__name__)
+
+
+def get_score_id(window, driver_id):
+    """ Id of the score of a driver in a window """
+    return f"{window}:{driver_id}"
+
+
+def build_leaderboard_updates(penalties, now):
+    """
+    Pre-aggregate penalty points per driver and hourly bucket. Returns the bucket upserts and the score upserts of
+    every window that still covers the bucket.
+    """
+    points = dict()
+    for penalty in penalties:
+        key = (penalty["driver_id"], get_bucket(penalty["created_at"]))
+        points[key] = points.get(key, 0) + penalty["penalty_points"]
+
+    scores = dict()
+    for (driver_id, bucket), value in points.items():
+        for window, duration in WINDOWS.items():
+            if bucket > get_bucket(now) - duration:
+                key = (window, driver_id)
+                scores[key] = scores.get(key, 0) + value
+
+    buckets = [
+        UpdateOne(
+            {"driver_id": driver_id, "bucket": bucket},
+            {"$inc": {"points": value}},
+            upsert=True
+        )
+        for (driver_id, bucket), value in points.items()
+    ]
+    scores = [
+        UpdateOne(
+            {"_id": get_score_id(window, driver_id)},
+            {"$inc": {"score": value}, "$setOnInsert": {"window": window, "driver_id": driver_id}},
+            upsert=True
+        )
+        for (window, driver_id), value in scores.items()
+    ]
+    return buckets, scores
+
+
+def update_leaderboard(db, penalties):
+    """ Add stored penalties to the hourly risk buckets and to the scores of all windows, one bulk write each """
+    buckets, scores = build_leaderboard_updates(penalties, datetime.utcnow())
+    if not buckets:
+        return
+
+    try:
+        db.fms_driver_risk_buckets.bulk_write(buckets, ordered=False)
+        db.fms_driver_risk_scores.bulk_write(scores, ordered=False)
+    except PyMongoError as e:
+        # penalties are already stored, scores can be rebuilt with the rebuild command
+        logger.error(f"Failed to update risk scores of {len(buckets)} driver buckets: {e}")
+
+
+def claim_bucket(db, window, bucket):
+    """
+    Atomically advance the expiry position of a window past a bucket. Only the worker whose update matched the
+    current position gets to subtract the bucket from the window scores.
+    """
+    return db.fms_driver_risk_windows.find_one_and_update(
+        {"_id": window, "expired_until": bucket},
+        {"$set": {"expired_until": bucket + BUCKET_SIZE}},
+        return_document=ReturnDocument.AFTER
+    ) is not None
+
+
+def expire_leaderboard(db, now=None):
+    """ Subtract buckets that slid out of every window from the window scores, one hourly bucket at a time """
+    cutoff = get_bucket(now or datetime.utcnow())
+    try:
+        for window, duration in WINDOWS.items():
+            # new windows start with the buckets that are still inside them
+            db.fms_driver_risk_windows.update_one(
+                {"_id": window},
+                {"$setOnInsert": {"expired_until": cutoff - duration + BUCKET_SIZE}},
+                upsert=True
+            )
+
+            state = db.fms_driver_risk_windows.find_one({"_id": window})
+            bucket = state["expired_until"]
+            while bucket <= cutoff - duration and claim_bucket(db, window, bucket):
+                updates = [
+                    UpdateOne(
+                        {"_id": get_score_id(window, entity["driver_id"])}, {"$inc": {"score": -entity["points"]}}
+                    )
+                    for entity in db.fms_driver_risk_buckets.find({"bucket": bucket})
+                ]
+                if updates:
+                    db.fms_driver_risk_scores.bulk_write(updates, ordered=False)
+                bucket += BUCKET_SIZE
+
+            # drivers without penalties in the window leave the leaderboard
+            db.fms_driver_risk_scores.delete_many({"window": window, "score": {"$lte": 0}})
+    except PyMongoError as e:
+        logger.error(f"Failed to expire risk scores: {e}")
+
+
+def rebuild_leaderboard(db, now=None):
+    """
+    Recompute the scores of every window from the hourly buckets. Consumers should be stopped while the rebuild
+    runs, otherwise penalties stored in the meantime are not counted.
+    """
+    cutoff = get_bucket(now or datetime.utcnow())
+    db.fms_driver_risk_scores.delete_many({})
+    for window, duration in WINDOWS.items():
+        db.fms_driver_risk_buckets.aggregate([
+            {"$match": {"bucket": {"$gt": cutoff - duration}}},
+            {"$group": {"_id": "$driver_id", "score": {"$sum": "$points"}}},
+            {
+                "$project": {
+                    "_id": {"$concat": [f"{window}:", "$_id"]},
+                    "window": {"$literal": window},
+                    "driver_id": "$_id",
+                    "score": 1
+                }
+            },
+            {"$merge": {"into": "fms_driver_risk_scores"}}
+        ])
+        db.fms_driver_risk_windows.replace_one(
+            {"_id": window}, {"expired_until": cutoff - duration + BUCKET_SIZE}, upsert=True
+        )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+
+    from database.database import db
+
+    logger.info("Rebuilding driver risk scores")
+    rebuild_leaderboard(db)
+    logger.info(f"Rebuilt {db.fms_driver_risk_scores.estimated_document_count()} driver risk scores")
@@ -0,0 +1,24 @@
+from prometheus_client import Counter, Histogram
+
+MESSAGES = Counter("fms_consumer_messages_total", "Consumed messages by outcome", ["shard", "outcome"])
+UNASSIGNED_MESSAGES = Counter(
+    "fms_consumer_unassigned_messages_total", "Acknowledged messages of cars without a driver", ["shard"]
+)
+FLUSHED_BATCH_SIZE = Histogram(
+    "fms_consumer_batch_size",
+    "Readings per flushed batch",
+    ["shard"],
+    buckets=(1, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+)
+ACK_LAG = Histogram(
+    "fms_consumer_ack_lag_seconds",
+    "Time from publishing a message until it is acknowledged",
+    ["shard"],
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+DB_WRITE_DURATION = Histogram(
+    "fms_consumer_db_write_duration_seconds",
+    "Duration of the database writes of a batch",
+    ["shard", "operation"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
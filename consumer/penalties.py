@@ -0,0 +1,75 @@
+import json
+
+import numpy as np
+from decouple import config
+
+# speed bands of the penalty rules, a speed in (min_speed, max_speed] scores factor * (speed - pivot) points
+DEFAULT_PENALTY_RULES = [
+    {"min_speed": 60, "max_speed": 80, "pivot": 80, "factor": -1},
+    {"min_speed": 80, "max_speed": 100, "pivot": 100, "factor": -2},
+    {"min_speed": 100, "max_speed": None, "pivot": 100, "factor": 5},
+]
+
+
+class PenaltyRules(object):
+    """
+    Table of speed bands used to score penalty points. Bands are matched in order and the first band that contains
+    the speed wins; speeds outside of every band score no points.
+    """
+
+    def __init__(self, rules):
+        self.rules = rules
+        self._bands = [
+            (
+                rule["min_speed"],
+                np.iinfo(np.int64).max if rule.get("max_speed") is None else rule["max_speed"],
+                rule["pivot"],
+                rule["factor"]
+            )
+            for rule in rules
+        ]
+
+    @staticmethod
+    def validate(rules):
+        """
+        Check that rules are a list of bands with integer `min_speed`, `pivot` and `factor`, ordered by speed and
+        not overlapping. Only the last band may leave `max_speed` open.
+        """
+        if not isinstance(rules, list):
+            raise ValueError("Penalty rules must be a list of speed bands")
+
+        previous = None
+        for index, rule in enumerate(rules):
+            if not isinstance(rule, dict):
+                raise ValueError(f"Penalty rule {index} must be an object")
+            for key in ("min_speed", "pivot", "factor"):
+                if not isinstance(rule.get(key), int) or isinstance(rule.get(key), bool):
+                    raise ValueError(f"Penalty rule {index} requires an integer '{key}'")
+
+            max_speed = rule.get("max_speed")
+            if max_speed is not None and (not isinstance(max_speed, int) or max_speed <= rule["min_speed"]):
+                raise ValueError(f"Penalty rule {index} requires an integer 'max_speed' above its 'min_speed'")
+            open_ended = previous is not None and previous.get("max_speed") is None
+            if open_ended or (previous is not None and rule["min_speed"] < previous["max_speed"]):
+                raise ValueError(f"Penalty rule {index} overlaps the previous rule, rules must be ordered by speed")
+            previous = rule
+
+        return rules
+
+    @classmethod
+    def from_config(cls):
+        """ Load penalty rules from the PENALTY_RULES json setting, falling back to the default rules """
+        rules = config("PENALTY_RULES", default=json.dumps(DEFAULT_PENALTY_RULES), cast=json.loads)
+        return cls(cls.validate(rules))
+
+    def score(self, speeds):
+        """ Calculate penalty points of a batch of speeds in a single vectorized pass """
+        speeds = np.asarray(speeds, dtype=np.int64)
+        points = np.zeros(speeds.shape, dtype=np.int64)
+
+        # apply bands in reverse so that the first matching band overwrites the others
+        for min_speed, max_speed, pivot, factor in reversed(self._bands):
+            np.copyto(points, factor * (speeds - pivot), where=(speeds > min_speed) & (speeds <= max_speed))
+
+        return points
+
@@ -0,0 +1,98 @@
+import logging
+import sys
+
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+logger = logging.getLogger(__name__)
+
+
+def build_summary_updates(penalties):
+    """ Pre-aggregate penalties per driver and day and build one summary upsert per driver """
+    summaries = dict()
+    for penalty in penalties:
+        summary = summaries.setdefault(penalty["driver_id"], {"$inc": dict(), "$max": dict()})
+        day = penalty["created_at"].strftime("%Y-%m-%d")
+
+        increments = summary["$inc"]
+        for key, value in (
+            ("total_points", penalty["penalty_points"]),
+            ("count", 1),
+            (f"daily.{day}.points", penalty["penalty_points"]),
+            (f"daily.{day}.count", 1)
+        ):
+            increments[key] = increments.get(key, 0) + value
+
+        maximums = summary["$max"]
+        for key, value in (("max_speed", penalty["speed"]), ("last_violation_at", penalty["created_at"])):
+            maximums[key] = max(maximums.get(key, value), value)
+
+    return [UpdateOne({"_id": driver_id}, update, upsert=True) for driver_id, update in summaries.items()]
+
+
+def update_penalty_summaries(collection, penalties):
+    """ Incrementally update the penalty summaries of the drivers of the given penalties with a single bulk write """
+    updates = build_summary_updates(penalties)
+    if not updates:
+        return
+
+    try:
+        collection.bulk_write(updates, ordered=False)
+    except PyMongoError as e:
+        # penalties are already stored, summaries can be rebuilt with the backfill command
+        logger.error(f"Failed to update penalty summaries of {len(updates)} drivers: {e}")
+
+
+def backfill_penalty_summaries(penalties_collection, summaries_collection):
+    """
+    Rebuild all penalty summaries from the stored penalties, replacing the summaries collection. Consumers should be
+    stopped while the backfill runs, otherwise penalties stored in the meantime are not counted.
+    """
+    penalties_collection.aggregate([
+        {
+            "$group": {
+                "_id": {
+                    "driver_id": "$driver_id",
+                    "day": {"$dateToString": {"format": "%Y-%m-%d", "date": "$created_at"}}
+                },
+                "points": {"$sum": "$penalty_points"},
+                "count": {"$sum": 1},
+                "max_speed": {"$max": "$speed"},
+                "last_violation_at": {"$max": "$created_at"}
+            }
+        },
+        {
+            "$group": {
+                "_id": "$_id.driver_id",
+                "total_points": {"$sum": "$points"},
+                "count": {"$sum": "$count"},
+                "max_speed": {"$max": "$max_speed"},
+                "last_violation_at": {"$max": "$last_violation_at"},
+                "daily": {"$push": {"k": "$_id.day", "v": {"points": "$points", "count": "$count"}}}
+            }
+        },
+        {
+            # penalties stored before violation times were recorded do not belong to any day
+            "$set": {
+                "daily": {
+                    "$arrayToObject": {"$filter": {"input": "$daily", "cond": {"$ne": ["$$this.k", None]}}}
+                }
+            }
+        },
+        {"$out": summaries_collection.name}
+    ], allowDiskUse=True)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+
+    from database.database import fms_drivers_penalties, fms_drivers_penalty_summaries
+
+    logger.info("Rebuilding driver penalty summaries")
+    backfill_penalty_summaries(fms_drivers_penalties, fms_drivers_penalty_summaries)
+    logger.info(f"Rebuilt {fms_drivers_penalty_summaries.estimated_document_count()} driver penalty summaries")
@@ -0,0 +1,118 @@
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import time
+
+from decouple import config
+
+from messaging.routing import SHARDS
+
+logger = logging.getLogger(__name__)
+
+
+def configure_logging():
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(processName)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+
+
+def run_worker(amqp_url, shard):
+    """ Worker process entry point. Consume the queue of a single shard with its own connection and channel. """
+    configure_logging()
+
+    # imported in the worker so that database connections are only created after the process started
+    from consumer.consumer import Consumer
+
+    consumer = Consumer(amqp_url=amqp_url, shard=shard)
+    consumer.run()
+
+
+class Supervisor(object):
+    """ Starts one consumer worker process per shard and restarts workers that die. """
+
+    RESTART_DELAY = config("CONSUMER_RESTART_DELAY", default=5, cast=int)
+    STOP_TIMEOUT = 10
+    POLL_INTERVAL = 1
+
+    def __init__(self, amqp_url, shards=SHARDS):
+        self._url = amqp_url
+        self._shards = shards
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = dict()
+        self._stopping = False
+
+    def start_worker(self, shard):
+        """ Start the worker process of the given shard """
+        process = self._context.Process(
+            target=run_worker,
+            args=(self._url, shard),
+            name=f"consumer-{shard}",
+            daemon=False
+        )
+        process.start()
+        self._workers[shard] = process
+        logger.info(f"Started consumer worker {process.name} (pid {process.pid})")
+
+    def monitor(self):
+        """ Restart workers that exited until the supervisor is stopped. """
+        restarts = dict()
+        while not self._stopping:
+            now = time.monotonic()
+            for shard, process in list(self._workers.items()):
+                if process.is_alive():
+                    continue
+
+                if shard not in restarts:
+                    logger.warning(
+                        f"Consumer worker {process.name} exited with code {process.exitcode}, "
+                        f"restarting in {self.RESTART_DELAY} seconds"
+                    )
+                    restarts[shard] = now + self.RESTART_DELAY
+                elif now >= restarts[shard]:
+                    del restarts[shard]
+                    self.start_worker(shard)
+
+            time.sleep(self.POLL_INTERVAL)
+
+    def stop(self, *args):
+        """ Invoked on SIGINT and SIGTERM. Stop monitoring workers. """
+        self._stopping = True
+
+    def shutdown(self):
+        """ Ask all workers to stop gracefully and terminate the ones that do not. """
+        for process in self._workers.values():
+            if process.is_alive():
+                os.kill(process.pid, signal.SIGINT)
+
+        deadline = time.monotonic() + self.STOP_TIMEOUT
+        for process in self._workers.values():
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"Consumer worker {process.name} did not stop, terminating")
+                process.terminate()
+                process.join()
+
+    def run(self):
+        """ Run supervisor until SIGINT or SIGTERM is received. """
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+
+        for shard in range(self._shards):
+            self.start_worker(shard)
+
+        try:
+            self.monitor()
+        finally:
+            self.shutdown()
+
+
+if __name__ == "__main__":
+    configure_logging()
+
+    supervisor = Supervisor(amqp_url=config("AMQP_URL"))
+    supervisor.run()
@@ -0,0 +1,98 @@
+import logging
+from datetime import datetime
+
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from database.geo import to_point
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+# rollup collections and the function truncating a reading timestamp to its bucket
+ROLLUPS = {
+    "fms_telemetry_minutely": lambda timestamp: timestamp.replace(second=0, microsecond=0),
+    "fms_telemetry_hourly": lambda timestamp: timestamp.replace(minute=0, second=0, microsecond=0)
+}
+
+
+def build_rollup_updates(readings, truncate):
+    """ Pre-aggregate readings per car and bucket and build one rollup upsert per bucket """
+    buckets = dict()
+    for reading in readings:
+        key = (reading["meta"]["car_id"], truncate(reading["timestamp"]))
+        bucket = buckets.setdefault(key, dict(
+            driver_id=reading["meta"]["driver_id"],
+            min_speed=reading["speed"],
+            max_speed=reading["speed"],
+            speed_sum=0,
+            count=0
+        ))
+        bucket["min_speed"] = min(bucket["min_speed"], reading["speed"])
+        bucket["max_speed"] = max(bucket["max_speed"], reading["speed"])
+        bucket["speed_sum"] += reading["speed"]
+        bucket["count"] += 1
+
+    return [
+        UpdateOne(
+            {"car_id": car_id, "bucket": timestamp},
+            {
+                "$set": {"driver_id": bucket["driver_id"]},
+                "$min": {"min_speed": bucket["min_speed"]},
+                "$max": {"max_speed": bucket["max_speed"]},
+                "$inc": {"speed_sum": bucket["speed_sum"], "count": bucket["count"]}
+            },
+            upsert=True
+        )
+        for (car_id, timestamp), bucket in buckets.items()
+    ]
+
+
+def claim_readings(db, reading_ids):
+    """
+    Record the ids of readings about to be stored. Time-series collections have no unique indexes, so the keys of
+    recently stored readings are kept in a collection of their own. Returns the ids stored by an earlier delivery.
+    """
+    now = datetime.utcnow()
+    try:
+        db.fms_telemetry_keys.insert_many([{"_id": id, "created_at": now} for id in reading_ids], ordered=False)
+    except BulkWriteError as e:
+        return {
+            reading_ids[error["index"]] for error in e.details.get("writeErrors", [])
+            if error["code"] == DUPLICATE_KEY_ERROR
+        }
+
+    return set()
+
+
+def store_telemetry(db, readings, reading_ids):
+    """
+    Store raw consumer readings in the time-series collection and update the per-minute and per-hour rollups, each
+    with a single bulk write. Readings already stored by an earlier delivery of their message are skipped, so that
+    they are not rolled up twice. Telemetry is best effort, failures are logged and do not affect acknowledgement.
+    """
+    if not readings:
+        return
+
+    try:
+        stored = claim_readings(db, reading_ids)
+        documents = [
+            {
+                "_id": reading_id,
+                "timestamp": timestamp,
+                "meta": {"car_id": data["car_id"], "driver_id": driver_id},
+                "speed": speed,
+                "location": to_point(data["latitude"], data["longitude"])
+            }
+            for (_, data, driver_id, timestamp, speed), reading_id in zip(readings, reading_ids)
+            if reading_id not in stored
+        ]
+        if not documents:
+            return
+
+        db.fms_telemetry.insert_many(documents, ordered=False)
+        for name, truncate in ROLLUPS.items():
+            db.get_collection(name).bulk_write(build_rollup_updates(documents, truncate), ordered=False)
+    except PyMongoError as e:
+        logger.error(f"Failed to store {len(readings)} telemetry readings: {e}")
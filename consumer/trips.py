@@ -0,0 +1,181 @@
+import logging
+from datetime import timedelta
+
+from bson import ObjectId
+from decouple import config
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.errors import BulkWriteError, PyMongoError
+
+from database.geo import haversine
+from database.versions import bump_version
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY_ERROR = 11000
+
+
+class TripTracker(object):
+    """
+    Segments the speed stream of every car of a shard into trips. A trip starts with the first reading at moving
+    speed and closes once the car has not been moving for the idle timeout, or its driver changes. Every open trip
+    keeps a fixed size state of running totals, which is checkpointed with every batch so that a restarted consumer
+    continues open trips where they were left.
+    """
+
+    MOVING_SPEED = config("TRIP_MOVING_SPEED", default=5, cast=int)
+    IDLE_TIMEOUT = config("TRIP_IDLE_TIMEOUT", default=300, cast=int)
+    MIN_DURATION = config("TRIP_MIN_DURATION", default=60, cast=int)
+
+    def __init__(self, db, shard=0):
+        self._db = db
+        self._shard = shard
+        self._states = dict()
+        self._changed = set()
+        self._closed = []
+        self.opened = 0
+        self.closed = 0
+
+    def load(self):
+        """ Restore the open trips of the shard from their last checkpoint """
+        self._states = {state["_id"]: state for state in self._db.fms_trip_states.find({"shard": self._shard})}
+        logger.info(f"Restored {len(self._states)} open trips")
+
+    def update(self, readings):
+        """ Apply consumer readings to the open trips of their cars, closing and opening trips as needed """
+        for _, data, driver_id, timestamp, speed in readings:
+            car_id = data["car_id"]
+            state = self._states.get(car_id)
+
+            if state is not None:
+                # readings redelivered after a restart are already part of the trip
+                if timestamp <= state["last_at"]:
+                    continue
+
+                idle = timestamp - state["last_moving_at"] > timedelta(seconds=self.IDLE_TIMEOUT)
+                if idle or state["driver_id"] != driver_id:
+                    self.close(state)
+                    state = None
+
+            if state is None:
+                if speed < self.MOVING_SPEED:
+                    continue
+                state = self.open(car_id, driver_id, timestamp, data["latitude"], data["longitude"])
+
+            distance = haversine(state["last_latitude"], state["last_longitude"], data["latitude"], data["longitude"])
+            state["distance"] += distance
+            state["last_latitude"] = data["latitude"]
+            state["last_longitude"] = data["longitude"]
+            state["last_at"] = timestamp
+            state["speed_sum"] += speed
+            state["count"] += 1
+            state["max_speed"] = max(state["max_speed"], speed)
+            if speed >= self.MOVING_SPEED:
+                # a trip ends with its last moving reading, later idle readings only count if the car moves again
+                state["last_moving_at"] = timestamp
+                state["trip"] = dict(
+                    distance=state["distance"],
+                    speed_sum=state["speed_sum"],
+                    count=state["count"],
+                    latitude=data["latitude"],
+                    longitude=data["longitude"]
+                )
+
+            self._changed.add(car_id)
+
+    def open(self, car_id, driver_id, timestamp, latitude, longitude):
+        """ Start a trip of a car """
+        state = dict(
+            _id=car_id,
+            shard=self._shard,
+            trip_id=ObjectId(),
+            driver_id=driver_id,
+            started_at=timestamp,
+            start_latitude=latitude,
+            start_longitude=longitude,
+            last_at=timestamp,
+            last_moving_at=timestamp,
+            last_latitude=latitude,
+            last_longitude=longitude,
+            distance=0.0,
+            speed_sum=0,
+            count=0,
+            max_speed=0,
+            trip=None
+        )
+        self._states[car_id] = state
+        self.opened += 1
+        return state
+
+    def close(self, state):
+        """ End a trip, trips shorter than the minimum duration are discarded as noise """
+        del self._states[state["_id"]]
+        self._changed.add(state["_id"])
+        self.closed += 1
+
+        duration = (state["last_moving_at"] - state["started_at"]).total_seconds()
+        if duration < self.MIN_DURATION:
+            return
+
+        trip = state["trip"]
+        self._closed.append(dict(
+            _id=state["trip_id"],
+            name=f"Trip of car {state['_id']}",
+            description=None,
+            car_id=state["_id"],
+            driver_id=state["driver_id"],
+            started_at=state["started_at"],
+            ended_at=state["last_moving_at"],
+            duration=duration,
+            distance=round(trip["distance"], 1),
+            avg_speed=round(trip["speed_sum"] / trip["count"], 1),
+            max_speed=state["max_speed"],
+            start_latitude=state["start_latitude"],
+            start_longitude=state["start_longitude"],
+            end_latitude=trip["latitude"],
+            end_longitude=trip["longitude"]
+        ))
+
+    def expire(self, now):
+        """ Close the trips of cars that stopped reporting for longer than the idle timeout """
+        for state in list(self._states.values()):
+            if now - state["last_moving_at"] > timedelta(seconds=self.IDLE_TIMEOUT):
+                self.close(state)
+
+    def save(self):
+        """
+        Store closed trips and checkpoint the changed trip states, each with a single bulk write. Trips keep the id
+        assigned when they were opened, so trips stored before a failed checkpoint are not stored twice.
+        """
+        if self._closed:
+            try:
+                self._db.fms_trips.insert_many(self._closed, ordered=False)
+            except BulkWriteError as e:
+                errors = [error for error in e.details.get("writeErrors", []) if error["code"] != DUPLICATE_KEY_ERROR]
+                if errors:
+                    logger.error(f"Failed to store {len(errors)} of {len(self._closed)} trips")
+                    return
+            except PyMongoError as e:
+                logger.error(f"Failed to store {len(self._closed)} trips: {e}")
+                return
+
+            # new trips change trip lists only, the API has not served or cached any of them yet
+            bump_version(self._db, "fms_trips")
+            self._closed = []
+
+        if not self._changed:
+            return
+
+        updates = [
+            ReplaceOne({"_id": car_id}, self._states[car_id], upsert=True)
+            if car_id in self._states else DeleteOne({"_id": car_id})
+            for car_id in self._changed
+        ]
+        try:
+            self._db.fms_trip_states.bulk_write(updates, ordered=False)
+            self._changed = set()
+        except PyMongoError as e:
+            # the changed states are written with the next checkpoint
+            logger.error(f"Failed to checkpoint {len(updates)} trip states: {e}")
+
+    def stats(self):
+        return dict(open=len(self._states), opened=self.opened, closed=self.closed)
@@ -0,0 +1,80 @@
+import motor.motor_asyncio
+
+from database.settings import MONGO_CONNECTION_STRING, get_client_options, get_read_preference
+
+
+class AsyncCollections(object):
+    """ Collections of the fms database """
+
+    def __init__(self):
+        self.db = None
+
+    @property
+    def fms_drivers(self):
+        return self.db.get_collection("fms_drivers")
+
+    @property
+    def fms_drivers_cars(self):
+        return self.db.get_collection("fms_drivers_cars")
+
+    @property
+    def fms_drivers_penalties(self):
+        return self.db.get_collection("fms_drivers_penalties")
+
+    @property
+    def fms_drivers_penalty_summaries(self):
+        return self.db.get_collection("fms_drivers_penalty_summaries")
+
+    @property
+    def fms_driver_risk_scores(self):
+        return self.db.get_collection("fms_driver_risk_scores")
+
+    @property
+    def fms_cars(self):
+        return self.db.get_collection("fms_cars")
+
+    @property
+    def fms_trips(self):
+        return self.db.get_collection("fms_trips")
+
+    @property
+    def fms_telemetry(self):
+        return self.db.get_collection("fms_telemetry")
+
+    @property
+    def fms_telemetry_minutely(self):
+        return self.db.get_collection("fms_telemetry_minutely")
+
+    @property
+    def fms_telemetry_hourly(self):
+        return self.db.get_collection("fms_telemetry_hourly")
+
+
+class AsyncDatabase(AsyncCollections):
+    """
+    asyncio MongoDB client used by the API. Opened and closed together with the application. Read only routes use
+    the collections of `reads`, which share the connection pool but may read from secondaries.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.client = None
+        self.reads = AsyncCollections()
+
+    def connect(self):
+        """ Initialize database connection pool """
+        self.client = motor.motor_asyncio.AsyncIOMotorClient(MONGO_CONNECTION_STRING, **get_client_options())
+        self.db = self.client.fms
+        self.reads.db = self.client.get_database("fms", read_preference=get_read_preference())
+
+    def close(self):
+        """ Close all database connections """
+        if self.client:
+            self.client.close()
+
+        self.client = None
+        self.db = None
+        self.reads.db = None
+
+
+mongo = AsyncDatabase()
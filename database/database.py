@@ -1,8 +1,9 @@
 import pymongo
-from decouple import config
+
+from database.settings import MONGO_CONNECTION_STRING, get_client_options
 
 # get connection string from .env file and initialize database connection
-client = pymongo.MongoClient(config("MONGO_CONNECTION_STRING"))
+client = pymongo.MongoClient(MONGO_CONNECTION_STRING, **get_client_options())
 # create database
 db = client.fms
 
@@ -10,5 +11,6 @@ db = client.fms
 fms_drivers = db.get_collection("fms_drivers")
 fms_drivers_cars = db.get_collection("fms_drivers_cars")
 fms_drivers_penalties = db.get_collection("fms_drivers_penalties")
+fms_drivers_penalty_summaries = db.get_collection("fms_drivers_penalty_summaries")
 fms_cars = db.get_collection("fms_cars")
 fms_trips = db.get_collection("fms_trips")
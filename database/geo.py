@@ -0,0 +1,65 @@
+import logging
+import math
+import sys
+
+# mean earth radius in metres, used to convert distances to radians for spherical queries
+EARTH_RADIUS = 6371008.8
+
+
+def to_point(latitude, longitude):
+    """ GeoJSON point of the given coordinates, GeoJSON orders coordinates as longitude, latitude """
+    return {"type": "Point", "coordinates": [float(longitude), float(latitude)]}
+
+
+def haversine(latitude1, longitude1, latitude2, longitude2):
+    """ Great-circle distance in metres between two coordinates """
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    a = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(longitude2 - longitude1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS * math.asin(math.sqrt(a))
+
+
+def to_bbox_polygon(min_longitude, min_latitude, max_longitude, max_latitude):
+    """ GeoJSON polygon of a bounding box """
+    return {
+        "type": "Polygon",
+        "coordinates": [[
+            [min_longitude, min_latitude],
+            [max_longitude, min_latitude],
+            [max_longitude, max_latitude],
+            [min_longitude, max_latitude],
+            [min_longitude, min_latitude]
+        ]]
+    }
+
+
+def backfill_penalty_locations(collection):
+    """ Store GeoJSON locations of penalties stored before locations were recorded """
+    return collection.update_many(
+        {"location": {"$exists": False}, "latitude": {"$ne": None}, "longitude": {"$ne": None}},
+        [{
+            "$set": {
+                "location": {
+                    "type": "Point",
+                    "coordinates": [{"$toDouble": "$longitude"}, {"$toDouble": "$latitude"}]
+                }
+            }
+        }]
+    )
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+
+    from database.database import fms_drivers_penalties
+
+    result = backfill_penalty_locations(fms_drivers_penalties)
+    logging.getLogger(__name__).info(f"Stored locations of {result.modified_count} penalties")
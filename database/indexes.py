@@ -0,0 +1,248 @@
+import argparse
+import logging
+import sys
+from datetime import datetime
+
+from bson import ObjectId
+from decouple import config
+from pymongo import ASCENDING, DESCENDING, GEOSPHERE, IndexModel
+from pymongo.errors import CollectionInvalid, OperationFailure
+
+from database.geo import to_bbox_polygon
+from database.leaderboard import WINDOWS
+
+logger = logging.getLogger(__name__)
+
+TELEMETRY_RETENTION_SECONDS = config("TELEMETRY_RETENTION_SECONDS", default=7 * 24 * 3600, cast=int)
+TELEMETRY_MINUTELY_RETENTION_SECONDS = config("TELEMETRY_MINUTELY_RETENTION_SECONDS", default=30 * 24 * 3600, cast=int)
+TELEMETRY_HOURLY_RETENTION_SECONDS = config("TELEMETRY_HOURLY_RETENTION_SECONDS", default=365 * 24 * 3600, cast=int)
+# keys of stored readings only need to outlive the redelivery of their messages
+TELEMETRY_KEYS_RETENTION_SECONDS = config("TELEMETRY_KEYS_RETENTION_SECONDS", default=24 * 3600, cast=int)
+# risk buckets are kept a day longer than the longest leaderboard window, so that they are expired from every window
+RISK_BUCKET_RETENTION_SECONDS = int(max(WINDOWS.values()).total_seconds()) + 24 * 3600
+
+# collections that need to be created explicitly, with their creation options
+COLLECTIONS = {
+    "fms_telemetry": dict(
+        timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": "seconds"},
+        expireAfterSeconds=TELEMETRY_RETENTION_SECONDS
+    )
+}
+
+# indexes of every collection, created idempotently on API, consumer and publisher startup
+INDEXES = {
+    "fms_drivers_cars": [
+        IndexModel([("driver_id", ASCENDING)], name="driver_id_unique", unique=True),
+        IndexModel([("car_id", ASCENDING)], name="car_id")
+    ],
+    "fms_drivers_penalties": [
+        IndexModel([("driver_id", ASCENDING), ("_id", ASCENDING)], name="driver_id"),
+        IndexModel([("location", GEOSPHERE)], name="location")
+    ],
+    "fms_trips": [
+        IndexModel([("car_id", ASCENDING), ("started_at", ASCENDING)], name="car_id_started_at")
+    ],
+    "fms_trip_states": [
+        IndexModel([("shard", ASCENDING)], name="shard")
+    ],
+    "fms_driver_risk_buckets": [
+        IndexModel([("driver_id", ASCENDING), ("bucket", ASCENDING)], name="driver_id_bucket", unique=True),
+        IndexModel([("bucket", ASCENDING)], name="ttl", expireAfterSeconds=RISK_BUCKET_RETENTION_SECONDS)
+    ],
+    "fms_driver_risk_scores": [
+        IndexModel([("window", ASCENDING), ("score", DESCENDING)], name="window_score")
+    ],
+    "fms_telemetry": [
+        IndexModel([("meta.car_id", ASCENDING), ("timestamp", ASCENDING)], name="car_id_timestamp")
+    ],
+    "fms_telemetry_keys": [
+        IndexModel([("created_at", ASCENDING)], name="ttl", expireAfterSeconds=TELEMETRY_KEYS_RETENTION_SECONDS)
+    ],
+    "fms_telemetry_minutely": [
+        IndexModel([("car_id", ASCENDING), ("bucket", ASCENDING)], name="car_id_bucket", unique=True),
+        IndexModel([("bucket", ASCENDING)], name="ttl", expireAfterSeconds=TELEMETRY_MINUTELY_RETENTION_SECONDS)
+    ],
+    "fms_telemetry_hourly": [
+        IndexModel([("car_id", ASCENDING), ("bucket", ASCENDING)], name="car_id_bucket", unique=True),
+        IndexModel([("bucket", ASCENDING)], name="ttl", expireAfterSeconds=TELEMETRY_HOURLY_RETENTION_SECONDS)
+    ]
+}
+
+# known query shapes per collection, checked for collection scans with `python -m database.indexes --check`
+QUERIES = [
+    ("fms_drivers", {"_id": {"$gt": ObjectId()}}, [("_id", ASCENDING)]),
+    ("fms_cars", {"_id": {"$gt": ObjectId()}}, [("_id", ASCENDING)]),
+    ("fms_trips", {"_id": {"$gt": ObjectId()}}, [("_id", ASCENDING)]),
+    ("fms_drivers_cars", {"car_id": ""}, None),
+    ("fms_drivers_cars", {"car_id": {"$in": [""]}, "driver_id": {"$ne": None}}, None),
+    ("fms_drivers_cars", {"driver_id": "", "car_id": {"$ne": None}}, None),
+    ("fms_drivers_cars", {"car_id": {"$ne": None}, "driver_id": {"$ne": None}}, None),
+    ("fms_drivers_penalties", {"driver_id": ""}, None),
+    ("fms_trip_states", {"shard": 0}, None),
+    ("fms_driver_risk_buckets", {"bucket": datetime.min}, None),
+    ("fms_driver_risk_scores", {"window": "24h"}, [("score", DESCENDING)]),
+    ("fms_telemetry_minutely", {"car_id": "", "bucket": {"$gte": datetime.min}}, [("bucket", ASCENDING)]),
+    ("fms_telemetry_hourly", {"car_id": "", "bucket": {"$gte": datetime.min}}, [("bucket", ASCENDING)]),
+    ("fms_drivers_penalties", {"location": {"$geoWithin": {"$centerSphere": [[33.0, 35.0], 0.0001]}}}, None),
+    ("fms_drivers_penalties", {"location": {"$geoWithin": {"$geometry": to_bbox_polygon(33, 35, 33.1, 35.1)}}}, None)
+]
+
+
+def ensure_collections(db):
+    """ Create all declared collections that do not exist yet and apply their retention """
+    existing = db.list_collection_names()
+    for name, options in COLLECTIONS.items():
+        try:
+            if name not in existing:
+                db.create_collection(name, **options)
+            elif "expireAfterSeconds" in options:
+                db.command("collMod", name, expireAfterSeconds=options["expireAfterSeconds"])
+        except (CollectionInvalid, OperationFailure) as e:
+            logger.error(f"Failed to create collection '{name}': {e}")
+
+
+async def ensure_collections_async(db):
+    """ Create all declared collections that do not exist yet using an asyncio database and apply their retention """
+    existing = await db.list_collection_names()
+    for name, options in COLLECTIONS.items():
+        try:
+            if name not in existing:
+                await db.create_collection(name, **options)
+            elif "expireAfterSeconds" in options:
+                await db.command("collMod", name, expireAfterSeconds=options["expireAfterSeconds"])
+        except (CollectionInvalid, OperationFailure) as e:
+            logger.error(f"Failed to create collection '{name}': {e}")
+
+
+def check_unique_indexes(name, existing):
+    """
+    Fail in case a declared unique index of a collection does not exist. Writes rely on unique indexes to reject
+    duplicates atomically, e.g. a second car of a driver, so they must not run without them.
+    """
+    missing = [
+        index.document["name"] for index in INDEXES[name]
+        if index.document.get("unique") and index.document["name"] not in existing
+    ]
+    if missing:
+        raise RuntimeError(
+            f"Unique indexes {', '.join(missing)} of collection '{name}' are missing, remove duplicate documents "
+            f"first, e.g. duplicate driver assignments with `python -m database.indexes --dedupe`"
+        )
+
+
+def get_ttl_changes(name, existing):
+    """
+    Existing TTL indexes of a collection whose retention differs from the declared one. Creating them again with
+    another retention conflicts with the existing index, so their retention is changed in place instead.
+    """
+    return [
+        {"name": index.document["name"], "expireAfterSeconds": index.document["expireAfterSeconds"]}
+        for index in INDEXES[name]
+        if "expireAfterSeconds" in index.document and index.document["name"] in existing
+        and existing[index.document["name"]].get("expireAfterSeconds") != index.document["expireAfterSeconds"]
+    ]
+
+
+def ensure_indexes(db):
+    """ Create all declared collections and indexes, existing indexes are left untouched apart from their TTL """
+    ensure_collections(db)
+    for name, indexes in INDEXES.items():
+        collection = db.get_collection(name)
+        try:
+            for index in get_ttl_changes(name, collection.index_information()):
+                db.command("collMod", name, index=index)
+                logger.info(f"Changed retention of index '{index['name']}' of collection '{name}'")
+            collection.create_indexes(indexes)
+        except OperationFailure as e:
+            logger.error(f"Failed to create indexes of collection '{name}': {e}")
+
+        check_unique_indexes(name, collection.index_information())
+
+
+async def ensure_indexes_async(db):
+    """
+    Create all declared collections and indexes using an asyncio database, existing indexes are left untouched
+    apart from their TTL
+    """
+    await ensure_collections_async(db)
+    for name, indexes in INDEXES.items():
+        collection = db.get_collection(name)
+        try:
+            for index in get_ttl_changes(name, await collection.index_information()):
+                await db.command("collMod", name, index=index)
+                logger.info(f"Changed retention of index '{index['name']}' of collection '{name}'")
+            await collection.create_indexes(indexes)
+        except OperationFailure as e:
+            logger.error(f"Failed to create indexes of collection '{name}': {e}")
+
+        check_unique_indexes(name, await collection.index_information())
+
+
+def dedupe_assignments(db):
+    """
+    Keep only the latest car assignment of every driver, so that the unique driver_id index can be created on a
+    database that already holds drivers with several cars. Returns the number of removed assignments.
+    """
+    duplicates = db.fms_drivers_cars.aggregate([
+        {"$sort": {"_id": DESCENDING}},
+        {"$group": {"_id": "$driver_id", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+        {"$match": {"count": {"$gt": 1}}}
+    ], allowDiskUse=True)
+
+    removed = 0
+    for duplicate in duplicates:
+        removed += db.fms_drivers_cars.delete_many({"_id": {"$in": duplicate["ids"][1:]}}).deleted_count
+        logger.info(f"Driver with ID '{duplicate['_id']}' kept its latest of {duplicate['count']} assignments")
+
+    return removed
+
+
+def get_plan_stages(plan):
+    """ Returns all stages of a query plan """
+    stages = [plan.get("stage")]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages.extend(get_plan_stages(plan[key]))
+    for input_stage in plan.get("inputStages", []):
+        stages.extend(get_plan_stages(input_stage))
+    return stages
+
+
+def check_query_plans(db):
+    """ Explain every known query and return the ones whose winning plan scans the whole collection """
+    collection_scans = []
+    for name, query, sort in QUERIES:
+        cursor = db.get_collection(name).find(query)
+        if sort:
+            cursor = cursor.sort(sort)
+
+        stages = get_plan_stages(cursor.explain()["queryPlanner"]["winningPlan"])
+        if "COLLSCAN" in stages:
+            collection_scans.append((name, query))
+            logger.error(f"{name} {query}: COLLSCAN")
+        else:
+            logger.info(f"{name} {query}: {' <- '.join(stage for stage in stages if stage)}")
+
+    return collection_scans
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO,
+        format="%(asctime)s - %(levelname)s - %(message)s",
+        datefmt="%Y-%m-%d %H:%M:%S",
+        handlers=[logging.StreamHandler(sys.stdout)]
+    )
+
+    parser = argparse.ArgumentParser(description="Create collection indexes")
+    parser.add_argument("--check", action="store_true", help="fail if any known query uses a collection scan")
+    parser.add_argument("--dedupe", action="store_true", help="keep only the latest car assignment of every driver")
+    args = parser.parse_args()
+
+    from database.database import db
+
+    if args.dedupe:
+        logger.info(f"Removed {dedupe_assignments(db)} duplicate driver assignments")
+    ensure_indexes(db)
+    if args.check and check_query_plans(db):
+        sys.exit(1)
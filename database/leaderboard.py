@@ -0,0 +1,25 @@
+import re
+from datetime import timedelta
+
+from decouple import Csv, config
+
+BUCKET_SIZE = timedelta(hours=1)
+WINDOW_UNITS = {"h": "hours", "d": "days"}
+
+
+def parse_window(window):
+    """ Translate a window like `24h` or `7d` to its duration, windows are whole hours """
+    match = re.fullmatch(r"(\d+)([hd])", window)
+    if not match or int(match.group(1)) == 0:
+        raise ValueError(f"Window '{window}' must be a number of hours or days, e.g. 24h or 7d")
+
+    return timedelta(**{WINDOW_UNITS[match.group(2)]: int(match.group(1))})
+
+
+def get_bucket(timestamp):
+    """ Hourly bucket of a timestamp """
+    return timestamp.replace(minute=0, second=0, microsecond=0)
+
+
+# sliding windows the driver risk scores are kept for
+WINDOWS = {window: parse_window(window) for window in config("LEADERBOARD_WINDOWS", default="1h,24h,7d", cast=Csv())}
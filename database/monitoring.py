@@ -0,0 +1,152 @@
+import threading
+import time
+from collections import defaultdict
+
+from prometheus_client import Counter, Gauge, Histogram
+from pymongo import monitoring
+
+MONGO_COMMAND_DURATION = Histogram(
+    "fms_mongo_command_duration_seconds",
+    "Duration of MongoDB commands",
+    ["command"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+MONGO_COMMAND_FAILURES = Counter("fms_mongo_command_failures_total", "Failed MongoDB commands", ["command"])
+
+
+class CommandMetrics(monitoring.CommandListener):
+    """ Records the duration of every MongoDB command, as measured by the driver """
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_DURATION.labels(event.command_name).observe(event.duration_micros / 1e6)
+
+    def failed(self, event):
+        MONGO_COMMAND_DURATION.labels(event.command_name).observe(event.duration_micros / 1e6)
+        MONGO_COMMAND_FAILURES.labels(event.command_name).inc()
+
+
+command_metrics = CommandMetrics()
+
+
+MONGO_POOL_WAITING = Gauge("fms_mongo_pool_waiting", "Operations waiting for a pooled connection", ["address"])
+MONGO_POOL_CONNECTIONS = Gauge("fms_mongo_pool_connections", "Pooled connections by state", ["address", "state"])
+MONGO_POOL_CHECKOUT_DURATION = Histogram(
+    "fms_mongo_pool_checkout_duration_seconds",
+    "Time to check out a pooled connection",
+    ["address"],
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30)
+)
+MONGO_POOL_CHECKOUT_FAILURES = Counter(
+    "fms_mongo_pool_checkout_failures_total", "Failed connection checkouts", ["address", "reason"]
+)
+
+
+class PoolStats(object):
+    """ Connection pool counters of a single server """
+
+    def __init__(self):
+        self.open = 0
+        self.in_use = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.checkouts = 0
+        self.failed_checkouts = 0
+        self.checkout_time = 0.0
+        self.max_checkout_time = 0.0
+
+    def to_json(self):
+        return dict(
+            open=self.open,
+            in_use=self.in_use,
+            waiting=self.waiting,
+            max_waiting=self.max_waiting,
+            checkouts=self.checkouts,
+            failed_checkouts=self.failed_checkouts,
+            avg_checkout_ms=self.checkout_time / self.checkouts * 1000 if self.checkouts else 0.0,
+            max_checkout_ms=self.max_checkout_time * 1000
+        )
+
+
+class PoolMetrics(monitoring.ConnectionPoolListener):
+    """
+    Tracks connection pool saturation per server: connections in use, operations waiting for a connection and how
+    long checkouts take. A checkout starts and completes on the same thread, which times it.
+    """
+
+    def __init__(self):
+        self._pools = defaultdict(PoolStats)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        with self._lock:
+            self._pools[event.address].open += 1
+        MONGO_POOL_CONNECTIONS.labels(self.get_label(event.address), "open").inc()
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        with self._lock:
+            self._pools[event.address].open -= 1
+        MONGO_POOL_CONNECTIONS.labels(self.get_label(event.address), "open").dec()
+
+    def connection_check_out_started(self, event):
+        self._local.started_at = time.perf_counter()
+        with self._lock:
+            stats = self._pools[event.address]
+            stats.waiting += 1
+            stats.max_waiting = max(stats.max_waiting, stats.waiting)
+        MONGO_POOL_WAITING.labels(self.get_label(event.address)).inc()
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            stats = self._pools[event.address]
+            stats.waiting -= 1
+            stats.failed_checkouts += 1
+        MONGO_POOL_WAITING.labels(self.get_label(event.address)).dec()
+        MONGO_POOL_CHECKOUT_FAILURES.labels(self.get_label(event.address), event.reason).inc()
+
+    def connection_checked_out(self, event):
+        duration = time.perf_counter() - getattr(self._local, "started_at", time.perf_counter())
+        with self._lock:
+            stats = self._pools[event.address]
+            stats.waiting -= 1
+            stats.in_use += 1
+            stats.checkouts += 1
+            stats.checkout_time += duration
+            stats.max_checkout_time = max(stats.max_checkout_time, duration)
+        MONGO_POOL_WAITING.labels(self.get_label(event.address)).dec()
+        MONGO_POOL_CONNECTIONS.labels(self.get_label(event.address), "in_use").inc()
+        MONGO_POOL_CHECKOUT_DURATION.labels(self.get_label(event.address)).observe(duration)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self._pools[event.address].in_use -= 1
+        MONGO_POOL_CONNECTIONS.labels(self.get_label(event.address), "in_use").dec()
+
+    @staticmethod
+    def get_label(address):
+        return f"{address[0]}:{address[1]}"
+
+    def stats(self):
+        with self._lock:
+            return {self.get_label(address): stats.to_json() for address, stats in self._pools.items()}
+
+
+pool_metrics = PoolMetrics()
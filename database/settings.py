@@ -0,0 +1,52 @@
+from decouple import Csv, config
+from pymongo import ReadPreference
+
+from database.monitoring import command_metrics, pool_metrics
+
+MONGO_CONNECTION_STRING = config("MONGO_CONNECTION_STRING")
+MONGO_MAX_POOL_SIZE = config("MONGO_MAX_POOL_SIZE", default=100, cast=int)
+MONGO_MIN_POOL_SIZE = config("MONGO_MIN_POOL_SIZE", default=0, cast=int)
+# how long an operation waits for a pooled connection before it fails, 0 waits until the server selection timeout
+MONGO_WAIT_QUEUE_TIMEOUT_MS = config("MONGO_WAIT_QUEUE_TIMEOUT_MS", default=0, cast=int)
+MONGO_CONNECT_TIMEOUT_MS = config("MONGO_CONNECT_TIMEOUT_MS", default=20000, cast=int)
+MONGO_SOCKET_TIMEOUT_MS = config("MONGO_SOCKET_TIMEOUT_MS", default=0, cast=int)
+MONGO_SERVER_SELECTION_TIMEOUT_MS = config("MONGO_SERVER_SELECTION_TIMEOUT_MS", default=30000, cast=int)
+# wire compressors in order of preference, e.g. `zstd,zlib`, zstd and snappy need their optional packages
+MONGO_COMPRESSORS = config("MONGO_COMPRESSORS", default="", cast=Csv())
+# read preference of read only API routes, e.g. `secondaryPreferred` to offload reads to secondaries
+MONGO_READ_PREFERENCE = config("MONGO_READ_PREFERENCE", default="primary")
+
+# error code of change streams on servers that are not part of a replica set
+CHANGE_STREAMS_NOT_SUPPORTED = 40573
+
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST
+}
+
+
+def get_client_options():
+    """ Connection pool, timeout, compression and monitoring options shared by the sync and asyncio clients """
+    options = dict(
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS or None,
+        connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+        socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS or None,
+        serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        event_listeners=[command_metrics, pool_metrics]
+    )
+    if MONGO_COMPRESSORS:
+        options["compressors"] = ",".join(MONGO_COMPRESSORS)
+    return options
+
+
+def get_read_preference():
+    """ Read preference of read only API routes """
+    if MONGO_READ_PREFERENCE not in READ_PREFERENCES:
+        raise ValueError(f"MONGO_READ_PREFERENCE must be one of {', '.join(READ_PREFERENCES)}")
+
+    return READ_PREFERENCES[MONGO_READ_PREFERENCE]
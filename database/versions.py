@@ -0,0 +1,57 @@
+import functools
+import time
+
+from decouple import config
+from pymongo import ReturnDocument
+
+# per-collection version counters, bumped after every write to the collection they track
+VERSIONS_COLLECTION = "fms_versions"
+# versions are kept next to the entity cache of the API, in Redis for the shared cache and in MongoDB otherwise
+VERSIONS_BACKEND = config("CACHE_BACKEND", default="memory")
+VERSIONS_REDIS_URL = config("CACHE_REDIS_URL", default="redis://redis:6379/0")
+
+
+def get_version_key(collection):
+    """ Redis key of the version of a collection """
+    return f"{VERSIONS_COLLECTION}:{collection}"
+
+
+def get_initial_version():
+    """
+    First Redis version of a collection. Versions start from the clock, so a version that was evicted from Redis
+    starts over above every version it had before and never matches an entry cached under an earlier one.
+    """
+    return time.time_ns()
+
+
+@functools.lru_cache(maxsize=None)
+def get_redis_client(url):
+    # only required when versions are kept in Redis
+    import redis
+
+    return redis.from_url(url)
+
+
+def bump_version(db, collection):
+    """ Mark a collection as changed, must be called after the write completed """
+    if VERSIONS_BACKEND == "redis":
+        key = get_version_key(collection)
+        with get_redis_client(VERSIONS_REDIS_URL).pipeline() as pipeline:
+            pipeline.set(key, get_initial_version(), nx=True).incr(key).execute()
+        return
+
+    db.get_collection(VERSIONS_COLLECTION).update_one({"_id": collection}, {"$inc": {"version": 1}}, upsert=True)
+
+
+async def bump_version_async(db, collection):
+    """ Mark a collection as changed using an asyncio database and return its new version """
+    entity = await db.get_collection(VERSIONS_COLLECTION).find_one_and_update(
+        {"_id": collection}, {"$inc": {"version": 1}}, upsert=True, return_document=ReturnDocument.AFTER
+    )
+    return entity["version"]
+
+
+async def get_version_async(db, collection):
+    """ Current version of a collection using an asyncio database """
+    entity = await db.get_collection(VERSIONS_COLLECTION).find_one({"_id": collection})
+    return entity["version"] if entity else 0
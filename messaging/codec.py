@@ -0,0 +1,149 @@
+import hashlib
+import json
+import math
+import struct
+from datetime import datetime
+
+from bson import ObjectId
+
+# content types of telemetry messages, messages without a content type are JSON
+CONTENT_TYPE_JSON = "application/json"
+CONTENT_TYPE_BINARY = "application/x-fms-telemetry"
+
+# binary frame: version and number of readings, followed by fixed size readings of car ObjectId, speed, latitude and
+# longitude in micro-degrees and publish time in seconds since the epoch, all little-endian
+VERSION = 1
+FRAME_HEADER = struct.Struct("<BH")
+READING = struct.Struct("<12sHiid")
+MAX_FRAME_READINGS = 0xFFFF
+OBJECT_ID_SIZE = 12
+MAX_SPEED = 0xFFFF
+
+# fields every reading carries and their accepted types
+READING_FIELDS = {
+    "car_id": str,
+    "speed": (int, float),
+    "latitude": (int, float),
+    "longitude": (int, float),
+    "published_at": (int, float)
+}
+
+
+def get_content_type(telemetry_format):
+    """ Content type of the `json` or `binary` telemetry format """
+    if telemetry_format == "binary":
+        return CONTENT_TYPE_BINARY
+    if telemetry_format == "json":
+        return CONTENT_TYPE_JSON
+
+    raise ValueError(f"Unknown telemetry format '{telemetry_format}'")
+
+
+def get_car_id_bytes(car_id):
+    """ Bytes of a car ObjectId, shorter ids would be zero-padded to a different car """
+    value = bytes.fromhex(car_id)
+    if len(value) != OBJECT_ID_SIZE:
+        raise ValueError(f"Car ID '{car_id}' is not an ObjectId")
+
+    return value
+
+
+def validate_reading(reading):
+    """
+    Check that a decoded reading has every field with a usable value. Readings that would fail once they are
+    stored are rejected up front, as they would fail the same way on every redelivery.
+    """
+    if not isinstance(reading, dict):
+        raise ValueError("Reading must be an object")
+
+    for field, types in READING_FIELDS.items():
+        value = reading.get(field)
+        if not isinstance(value, types) or isinstance(value, bool):
+            raise ValueError(f"Reading field '{field}' is missing or has a wrong type")
+        if isinstance(value, float) and not math.isfinite(value):
+            raise ValueError(f"Reading field '{field}' must be a finite number")
+
+    if not 0 <= reading["speed"] <= MAX_SPEED:
+        raise ValueError("Reading speed is out of range")
+    if not -90 <= reading["latitude"] <= 90 or not -180 <= reading["longitude"] <= 180:
+        raise ValueError("Reading coordinates are out of range")
+
+    try:
+        datetime.utcfromtimestamp(reading["published_at"])
+    except (OverflowError, OSError, ValueError):
+        raise ValueError("Reading publish time is out of range")
+
+    return reading
+
+
+def encode_binary(readings):
+    """ Encode readings as a single binary frame """
+    if len(readings) > MAX_FRAME_READINGS:
+        raise ValueError(f"A frame holds at most {MAX_FRAME_READINGS} readings")
+
+    try:
+        return FRAME_HEADER.pack(VERSION, len(readings)) + b"".join(
+            READING.pack(
+                get_car_id_bytes(reading["car_id"]),
+                reading["speed"],
+                round(reading["latitude"] * 1_000_000),
+                round(reading["longitude"] * 1_000_000),
+                reading["published_at"]
+            )
+            for reading in readings
+        )
+    except struct.error as e:
+        raise ValueError(f"Reading cannot be encoded: {e}")
+
+
+def decode_binary(body):
+    """ Decode a binary frame to readings """
+    if len(body) < FRAME_HEADER.size:
+        raise ValueError("Frame is too short")
+
+    version, count = FRAME_HEADER.unpack_from(body)
+    if version != VERSION:
+        raise ValueError(f"Unsupported frame version {version}")
+    if len(body) != FRAME_HEADER.size + count * READING.size:
+        raise ValueError(f"Frame size does not match its {count} readings")
+
+    return [
+        dict(
+            car_id=car_id.hex(),
+            speed=speed,
+            latitude=latitude / 1_000_000,
+            longitude=longitude / 1_000_000,
+            published_at=published_at
+        )
+        for car_id, speed, latitude, longitude, published_at in READING.iter_unpack(body[FRAME_HEADER.size:])
+    ]
+
+
+def encode(readings, content_type=CONTENT_TYPE_JSON):
+    """ Encode readings in the given content type. A single JSON reading is encoded as an object, like before. """
+    if content_type == CONTENT_TYPE_BINARY:
+        return encode_binary(readings)
+
+    return bytes(json.dumps(readings[0] if len(readings) == 1 else readings), encoding="utf8")
+
+
+def decode(body, content_type=None):
+    """ Decode a message of any content type to its readings, raises ValueError for malformed messages """
+    if content_type == CONTENT_TYPE_BINARY:
+        readings = decode_binary(body)
+    else:
+        data = json.loads(body)
+        readings = data if isinstance(data, list) else [data]
+
+    return [validate_reading(reading) for reading in readings]
+
+
+def get_reading_id(reading, index):
+    """
+    Deterministic id of a reading, from its car, publish time and position in its message. A redelivered message
+    produces the same ids, so penalties and telemetry stored by an earlier delivery are recognized as duplicates.
+    The id starts with the publish time like any ObjectId, so ids keep sorting by time.
+    """
+    key = f"{reading['car_id']}|{reading['published_at']!r}|{index}"
+    digest = hashlib.blake2b(key.encode("utf8"), digest_size=8).digest()
+    return ObjectId(struct.pack(">I", int(reading["published_at"]) & 0xFFFFFFFF) + digest)
@@ -0,0 +1,21 @@
+import zlib
+
+from decouple import config
+
+# number of queues telemetry is partitioned into, every shard is consumed by exactly one consumer worker
+SHARDS = config("FMS_SHARDS", default=1, cast=int)
+
+
+def get_shard(car_id, shards=SHARDS):
+    """ Stable shard of a car, all messages of the same car are routed to the same shard """
+    return zlib.crc32(car_id.encode("utf8")) % shards
+
+
+def get_shard_queue(queue, shard):
+    """ Name of the queue of the given shard """
+    return f"{queue}.{shard}"
+
+
+def get_shard_routing_key(routing_key, shard):
+    """ Topic routing key of the given shard """
+    return f"{routing_key}.{shard}"
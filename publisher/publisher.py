@@ -1,16 +1,36 @@
-import json
+import functools
+import itertools
 import logging
 import random
 import sys
+import threading
+import time
+from collections import defaultdict, deque
 
 import pika
 from decouple import config
 from pika.exchange_type import ExchangeType
+from prometheus_client import Counter, Gauge, Histogram, start_http_server
+from pymongo.errors import PyMongoError
 
-from database.database import fms_drivers_cars
+from database.database import db, fms_drivers_cars
+from database.indexes import ensure_indexes
+from messaging.codec import encode, get_content_type
+from messaging.routing import SHARDS, get_shard, get_shard_queue, get_shard_routing_key
 
 logger = logging.getLogger(__name__)
 
+MESSAGES_PUBLISHED = Counter("fms_publisher_messages_published_total", "Published messages")
+READINGS_PUBLISHED = Counter("fms_publisher_readings_published_total", "Published readings, a message holds a frame")
+MESSAGES_CONFIRMED = Counter("fms_publisher_messages_confirmed_total", "Messages confirmed by RabbitMQ", ["result"])
+MESSAGES_IN_FLIGHT = Gauge("fms_publisher_messages_in_flight", "Published messages not confirmed yet")
+CONFIRM_LAG = Histogram(
+    "fms_publisher_confirm_lag_seconds",
+    "Time from publishing a message until RabbitMQ confirms it",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+TICK_DURATION = Histogram("fms_publisher_tick_duration_seconds", "Time to publish the messages of a tick")
+
 
 class Publisher(object):
 
@@ -19,11 +39,27 @@ class Publisher(object):
     QUEUE = "FMS"
     ROUTING_KEY = "FMS.exchange"
     PUBLISH_INTERVAL = config("PUBLISH_INTERVAL", cast=int)
+    CARS_REFRESH_INTERVAL = config("PUBLISHER_CARS_REFRESH_INTERVAL", default=60, cast=int)
+    MAX_IN_FLIGHT = config("PUBLISHER_MAX_IN_FLIGHT", default=1000, cast=int)
+    CHUNK_SIZE = config("PUBLISHER_CHUNK_SIZE", default=200, cast=int)
+    METRICS_PORT = config("PUBLISHER_METRICS_PORT", default=9200, cast=int)
+    # `json` or `binary` telemetry messages, with up to FRAME_SIZE readings of cars of the same shard per message
+    CONTENT_TYPE = get_content_type(config("TELEMETRY_FORMAT", default="json"))
+    FRAME_SIZE = config("PUBLISHER_FRAME_SIZE", default=1, cast=int)
 
     def __init__(self, amqp_url):
         self._url = amqp_url
         self._connection = None
         self._channel = None
+        self._cars = []
+        self._pending = deque()
+        self._publish_scheduled = False
+        self._blocked = False
+        self._message_number = 0
+        self._in_flight = dict()
+        self._tick_start = None
+        self._stats = self.reset_stats()
+        MESSAGES_IN_FLIGHT.set_function(lambda: len(self._in_flight))
 
     def connect(self):
         """ Connect to RabbitMQ server """
@@ -32,8 +68,21 @@ class Publisher(object):
 
     def on_connection_open(self, *args, **kwargs):
         """ This method is called by pika once the connection to RabbitMQ has been established """
+        self._connection.add_on_connection_blocked_callback(self.on_connection_blocked)
+        self._connection.add_on_connection_unblocked_callback(self.on_connection_unblocked)
         self._connection.channel(on_open_callback=self.on_channel_open)
 
+    def on_connection_blocked(self, *args, **kwargs):
+        """ Invoked by pika when RabbitMQ stops accepting messages, e.g. on a memory or disk alarm. """
+        logger.warning("Connection blocked by RabbitMQ, pausing publishing")
+        self._blocked = True
+
+    def on_connection_unblocked(self, *args, **kwargs):
+        """ Invoked by pika when RabbitMQ accepts messages again. """
+        logger.info("Connection unblocked by RabbitMQ, resuming publishing")
+        self._blocked = False
+        self.schedule_publish_chunk()
+
     def on_channel_open(self, channel):
         """ This method is called by pika when the channel has been opened. Declare channel exchange. """
         self._channel = channel
@@ -49,46 +98,191 @@ class Publisher(object):
         self.close_connection()
 
     def on_exchange_declareok(self, *args, **kwargs):
-        """ Invoked by pika when RabbitMQ finished with declaring the exchange. Declare channel queue. """
-        self._channel.queue_declare(queue=self.QUEUE, callback=self.on_queue_declareok)
+        """ Invoked by pika when RabbitMQ finished with declaring the exchange. Declare the queue of every shard. """
+        self.declare_shard_queue(0)
+
+    def declare_shard_queue(self, shard):
+        """ Declare channel queue of the given shard. """
+        self._channel.queue_declare(
+            queue=get_shard_queue(self.QUEUE, shard),
+            callback=functools.partial(self.on_queue_declareok, shard=shard)
+        )
 
-    def on_queue_declareok(self, *args, **kwargs):
-        """ Bind the queue and exchange together. """
+    def on_queue_declareok(self, *args, shard=0, **kwargs):
+        """ Bind the shard queue and exchange together. """
         self._channel.queue_bind(
-            queue=self.QUEUE,
+            queue=get_shard_queue(self.QUEUE, shard),
             exchange=self.EXCHANGE,
-            routing_key=self.ROUTING_KEY,
-            callback=self.on_bindok
+            routing_key=get_shard_routing_key(self.ROUTING_KEY, shard),
+            callback=functools.partial(self.on_bindok, shard=shard)
         )
 
-    def on_bindok(self, *args, **kwargs):
+    def on_bindok(self, *args, shard=0, **kwargs):
         """ Invoked by pika when it receives the bind ok response from RabbitMQ. Schedule next message. """
+        if shard + 1 < SHARDS:
+            self.declare_shard_queue(shard + 1)
+        else:
+            self._channel.confirm_delivery(
+                ack_nack_callback=self.on_delivery_confirmation,
+                callback=self.on_confirm_selectok
+            )
+
+    def on_confirm_selectok(self, *args, **kwargs):
+        """ Invoked by pika when the channel is in confirm mode. Load cars and schedule next message. """
+        self.refresh_cars()
         self.schedule_next_message()
 
+    def refresh_cars(self):
+        """ Load cars with drivers in a background thread so that the IOLoop is never blocked. """
+        threading.Thread(target=self.load_cars, name="publisher-cars", daemon=True).start()
+
+    def load_cars(self):
+        """ Fetch distinct cars with drivers and hand them over to the IOLoop. """
+        try:
+            cars = fms_drivers_cars.find({"car_id": {"$ne": None}, "driver_id": {"$ne": None}}).distinct("car_id")
+        except PyMongoError as e:
+            logger.error(f"Failed to load cars: {e}")
+            cars = None
+
+        self._connection.ioloop.add_callback_threadsafe(functools.partial(self.on_cars_loaded, cars))
+
+    def on_cars_loaded(self, cars):
+        """ Replace the cached cars, unless loading failed, and schedule next refresh. """
+        if cars is not None:
+            self._cars = cars
+            logger.info(f"Loaded {len(cars)} cars with drivers")
+
+        self._connection.ioloop.call_later(self.CARS_REFRESH_INTERVAL, self.refresh_cars)
+
     def schedule_next_message(self):
         """ Schedule message to be delivered in interval seconds. """
         self._connection.ioloop.call_later(self.PUBLISH_INTERVAL, self.publish_message)
 
     def publish_message(self):
-        """ Publish message to the RabbitMQ server queue. """
-        # fetch distinct cars with drivers
-        cars = fms_drivers_cars.find({"car_id": {"$ne": None}, "driver_id": {"$ne": None}}).distinct("car_id")
+        """ Publish a message for every cached car to the RabbitMQ server queue, spread over IOLoop iterations. """
+        self.schedule_next_message()
 
-        # generate random message for each car
+        if self._pending:
+            logger.warning(f"Skipping tick, {len(self._pending)} messages of the previous tick are still pending")
+            return
+
+        self._tick_start = time.monotonic()
+        self._pending.extend(self.build_frames(self._cars, self.FRAME_SIZE))
+        self.publish_chunk()
+
+    @staticmethod
+    def build_frames(cars, frame_size):
+        """ Group cars per shard into frames of up to frame size cars, every frame is published as one message. """
+        shards = defaultdict(list)
         for car_id in cars:
-            # generate random car speed
-            speed = random.randint(0, 200)
+            shards[get_shard(car_id)].append(car_id)
 
-            # generate geo-coordinates
-            lat, long, = (round(random.uniform(34.707130, 35.185566), 6), round(random.uniform(32.429737, 33.636631), 6))
-            data = dict(car_id=car_id, speed=speed, latitude=lat, longitude=long)
+        return [
+            (shard, car_ids[index:index + frame_size])
+            for shard, car_ids in shards.items()
+            for index in range(0, len(car_ids), frame_size)
+        ]
 
-            # publish message
-            message = bytes(json.dumps(data), encoding="utf8")
-            self._channel.basic_publish(exchange=self.EXCHANGE, routing_key=self.ROUTING_KEY, body=message)
-            logger.info(f"Published message {message}")
+    def schedule_publish_chunk(self):
+        """ Schedule publishing of the next chunk on the next IOLoop iteration. """
+        if self._pending and not self._publish_scheduled:
+            self._publish_scheduled = True
+            self._connection.ioloop.call_later(0, self.publish_chunk)
 
-        self.schedule_next_message()
+    def publish_chunk(self):
+        """ Publish up to a chunk of pending messages while the in flight window is not full. """
+        self._publish_scheduled = False
+
+        published = 0
+        while (
+            self._pending and not self._blocked and published < self.CHUNK_SIZE
+            and len(self._in_flight) < self.MAX_IN_FLIGHT
+        ):
+            self.publish(self._pending.popleft())
+            published += 1
+
+        if not self._pending:
+            self.on_tick_published()
+        elif not self._blocked and len(self._in_flight) < self.MAX_IN_FLIGHT:
+            # yield to the IOLoop between chunks, publishing continues on confirmations otherwise
+            self.schedule_publish_chunk()
+
+    @staticmethod
+    def build_message(car_id):
+        """ Generate random telemetry of the given car. """
+        # generate random car speed
+        speed = random.randint(0, 200)
+
+        # generate geo-coordinates
+        lat, long, = (round(random.uniform(34.707130, 35.185566), 6), round(random.uniform(32.429737, 33.636631), 6))
+        return dict(car_id=car_id, speed=speed, latitude=lat, longitude=long, published_at=time.time())
+
+    def publish(self, frame):
+        """ Publish the readings of a frame as a single message and track it until RabbitMQ confirms it. """
+        shard, car_ids = frame
+        message = encode([self.build_message(car_id) for car_id in car_ids], self.CONTENT_TYPE)
+        self._channel.basic_publish(
+            exchange=self.EXCHANGE,
+            routing_key=get_shard_routing_key(self.ROUTING_KEY, shard),
+            body=message,
+            properties=pika.BasicProperties(content_type=self.CONTENT_TYPE)
+        )
+
+        self._message_number += 1
+        self._in_flight[self._message_number] = time.monotonic()
+        self._stats["published"] += 1
+        MESSAGES_PUBLISHED.inc()
+        READINGS_PUBLISHED.inc(len(car_ids))
+        logger.debug(f"Published message {message}")
+
+    def on_delivery_confirmation(self, method_frame):
+        """ Invoked by pika when RabbitMQ acks or nacks published messages. """
+        confirmation = method_frame.method.NAME.split(".")[1].lower()
+        delivery_tag = method_frame.method.delivery_tag
+
+        # confirmations are in order, with multiple set they cover every message up to the delivery tag
+        if method_frame.method.multiple:
+            delivery_tags = list(itertools.takewhile(lambda tag: tag <= delivery_tag, self._in_flight))
+        else:
+            delivery_tags = [delivery_tag]
+
+        now = time.monotonic()
+        for tag in delivery_tags:
+            published_at = self._in_flight.pop(tag, None)
+            if published_at is None:
+                continue
+
+            lag = now - published_at
+            CONFIRM_LAG.observe(lag)
+            MESSAGES_CONFIRMED.labels(confirmation).inc()
+            self._stats["confirmed"] += 1
+            self._stats["lag_total"] += lag
+            self._stats["lag_max"] = max(self._stats["lag_max"], lag)
+            if confirmation == "nack":
+                self._stats["nacked"] += 1
+
+        # resume publishing once half of the in flight window is free
+        if len(self._in_flight) <= self.MAX_IN_FLIGHT // 2:
+            self.schedule_publish_chunk()
+
+    def on_tick_published(self):
+        """ Report publish latency of the tick and confirm lag since the previous tick. """
+        publish_time = (time.monotonic() - self._tick_start) * 1000
+        TICK_DURATION.observe(publish_time / 1000)
+        stats, self._stats = self._stats, self.reset_stats()
+        lag_avg = stats["lag_total"] / stats["confirmed"] * 1000 if stats["confirmed"] else 0
+
+        logger.info(
+            f"Published {stats['published']} messages in {'{0:.2f}'.format(publish_time)} ms, "
+            f"{len(self._in_flight)} in flight, confirm lag avg {'{0:.2f}'.format(lag_avg)} ms "
+            f"max {'{0:.2f}'.format(stats['lag_max'] * 1000)} ms"
+        )
+        if stats["nacked"]:
+            logger.warning(f"RabbitMQ rejected {stats['nacked']} messages")
+
+    @staticmethod
+    def reset_stats():
+        return dict(published=0, confirmed=0, nacked=0, lag_total=0.0, lag_max=0.0)
 
     def close_channel(self):
         """ Command to close the channel with RabbitMQ server. """
@@ -107,6 +301,10 @@ class Publisher(object):
 
     def run(self):
         """ Run publisher by connecting and starting the IOLoop. """
+        ensure_indexes(db)
+        if self.METRICS_PORT:
+            start_http_server(self.METRICS_PORT)
+
         try:
             self._connection = self.connect()
             self._connection.ioloop.start()